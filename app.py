@@ -1,87 +1,20 @@
 import streamlit as st
-from docx import Document
-from openpyxl import load_workbook
-from openpyxl.utils.datetime import from_excel
 from pathlib import Path
-import tempfile
-import shutil
 import os
 import logging
-import datetime
-import re
-
-logging.basicConfig(level=logging.INFO)
+import time
+import uuid
 
+import cache
+import server
+from engine import default_workers, process_pool_allowed
+from jobs import STATUS_CANCELLED, STATUS_DONE, STATUS_LABELS, STATUS_QUEUED, STATUS_RUNNING, AdmissionError, JobSpec, job_queue
+from pipeline import mode_folder
+from rules import MODES
 
-# ------------------------
-# Excel parsing
-# ------------------------
-def detect_columns(sheet):
-    cols = {
-        "fio": None,
-        "dob": None,
-        "position": None,
-        "risk": None,
-        "diagnosis": None,
-        "address": None,
-        "header": None,
-    }
-
-    for r in range(1, 21):
-        for c in range(1, 80):
-            val = sheet.cell(row=r, column=c).value
-            if not isinstance(val, str):
-                continue
-
-            txt = val.strip().lower()
-
-            if "фио" in txt:
-                cols["fio"] = cols["fio"] or c
-                cols["header"] = cols["header"] or r
-
-            if ("дата" in txt and "рожд" in txt) or ("д.р" in txt) or ("д р" in txt) or ("др" == txt.replace(".", "").replace(" ", "")):
-                cols["dob"] = cols["dob"] or c
-                cols["header"] = cols["header"] or r
-
-            if "адрес" in txt:
-                cols["address"] = cols["address"] or c
-                cols["header"] = cols["header"] or r
-
-            if "штатная должность" in txt or ("должность" in txt and "штат" in txt):
-                cols["position"] = cols["position"] or c
-            if "факторы риска" in txt or ("фактор" in txt and "риска" in txt):
-                cols["risk"] = cols["risk"] or c
-            if "мкб-10" in txt or "мкб 10" in txt or "мкб10" in txt:
-                cols["diagnosis"] = cols["diagnosis"] or c
-
-    return cols
-
-
-def validate_columns(cols: dict, mode: str):
-    if mode == "Заключение предварительное":
-        required = ["fio", "dob", "position", "risk", "diagnosis", "header"]
-    else:
-        required = ["fio", "dob", "address", "header"]
-    return [k for k in required if not cols.get(k)]
-
-
-def excel_date_to_str(value):
-    if value is None:
-        return ""
-    if isinstance(value, datetime.datetime):
-        return value.strftime("%d.%m.%Y")
-    if isinstance(value, datetime.date):
-        return datetime.datetime(value.year, value.month, value.day).strftime("%d.%m.%Y")
-    if isinstance(value, (int, float)):
-        try:
-            return from_excel(value).strftime("%d.%m.%Y")
-        except Exception:
-            return str(value)
-    return str(value)
-
+logging.basicConfig(level=logging.INFO)
 
-def make_safe_filename(text: str) -> str:
-    return re.sub(r"[^\w\-_. ]", "_", text.strip())
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
 
 
 # ------------------------
@@ -141,199 +74,63 @@ def build_fs_locations():
     return locations
 
 
-# ------------------------
-# DOCX replacement helpers
-# ------------------------
-def iter_all_paragraphs(doc: Document):
-    for p in doc.paragraphs:
-        yield p
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for p in cell.paragraphs:
-                    yield p
-
-
-def _is_field_run(run) -> bool:
-    """
-    Определяем run, который является "полем" с линией.
-    Для твоего шаблона это обычно:
-    - underline=True и текст пустой/пробелы
-    - или очень много пробелов/подчёркиваний
-    """
-    t = run.text or ""
-    stripped = t.strip()
-
-    # если подчёркнут и это пробелы/пустота — это почти точно поле
-    if getattr(run.font, "underline", None):
-        if stripped == "" and len(t) >= 2:
-            return True
-
-    # поле может быть без underline на самом run (underline в стиле),
-    # но текст тогда длинный и пробельный
-    if stripped == "" and len(t) >= 8:
-        return True
-
-    # поле из "_" (редко, но поддержим)
-    if t.count("_") >= 5:
-        return True
-
-    return False
-
-
-def fill_underlined_field_run(field_run, value: str):
-    """
-    Заполняем подчёркнутое поле:
-    value + хвост NBSP до исходной длины run.
-    NBSP нужен, чтобы Word не схлопывал пробелы.
-    """
-    original = field_run.text or ""
-    original_len = len(original)
-
-    NBSP = "\u00A0"
-
-    value = value or ""
-
-    # Гарантируем подчёркивание на поле (если оно было на стиле/частично, это не мешает)
-    field_run.font.underline = True
-
-    # Если value длиннее поля — не режем молча: поле расширится.
-    # Если хочешь строго по длине, раскомментируй:
-    # if len(value) > original_len:
-    #     value = value[:original_len]
-
-    pad_len = max(0, original_len - len(value))
-    field_run.text = value + (NBSP * pad_len)
-
-
-def replace_in_paragraph_keep_format(paragraph, key_predicate, new_value, once_state_key=None, once_state=None):
-    """
-    Для "диаскин":
-    - находим строку по key_predicate
-    - находим run-поле (подчёркнутые пробелы)
-    - заполняем его value + NBSP-хвостом, подчёркивание остаётся
-    """
-    full_text = paragraph.text or ""
-    if not key_predicate(full_text):
-        return False
-
-    low = full_text.lower()
-    if ("подпись" in low) or ("печать" in low) or ("направившего" in low):
-        return False
-
-    if once_state_key and once_state is not None and once_state.get(once_state_key, False):
-        return False
-
-    field_run = None
-    for run in paragraph.runs:
-        if _is_field_run(run):
-            field_run = run
-            break
-
-    if field_run is None:
-        # fallback: заменить после двоеточия (может убрать линию, но лучше чем ничего)
-        if ":" in full_text:
-            prefix = full_text.split(":", 1)[0] + ":"
-            for run in paragraph.runs:
-                run.text = ""
-            if paragraph.runs:
-                paragraph.runs[0].text = f"{prefix} {new_value}"
-            else:
-                paragraph.add_run(f"{prefix} {new_value}")
-            if once_state_key and once_state is not None:
-                once_state[once_state_key] = True
-            return True
-        return False
-
-    fill_underlined_field_run(field_run, str(new_value or ""))
-
-    if once_state_key and once_state is not None:
-        once_state[once_state_key] = True
-    return True
-
-
-def apply_replacements_old_logic(doc: Document, custom_jobplace: str, fio: str, birthdate: str, position: str, risk: str, diagnosis: str):
-    replacements = {
-        "1. Ф.И.О": f"1. Ф.И.О: {fio} {birthdate} г.р.",
-        "2. Место работы": f"2. Место работы: {custom_jobplace}",
-        "3. Профессия (должность) (в настоящее время)": f"3. Профессия (должность) (в настоящее время): {position}",
-        "Вредный производственный фактор": f"Вредный производственный фактор, наименование вида работ: {risk}",
-        "6. Наименование": f"6. Наименование: {diagnosis}",
-    }
-
-    for p in iter_all_paragraphs(doc):
-        txt = (p.text or "").strip()
-        for k, v in replacements.items():
-            if txt.startswith(k):
-                for run in p.runs:
-                    run.text = ""
-                if p.runs:
-                    p.runs[0].text = v
-                else:
-                    p.add_run(v)
-                break
-
-
-def apply_replacements_diaskin(doc: Document, fio: str, birthdate: str, address: str):
-    once = {"fio_done": False, "dob_done": False, "addr_done": False}
-
-    for p in iter_all_paragraphs(doc):
-
-        def is_fio_top(t: str) -> bool:
-            t2 = (t or "").replace(" ", "")
-            return ("ф.и.о.:" in t2.lower()) or ("фио:" in t2.lower())
-
-        replace_in_paragraph_keep_format(
-            p,
-            key_predicate=is_fio_top,
-            new_value=fio,
-            once_state_key="fio_done",
-            once_state=once,
-        )
-
-        def is_dob_line(t: str) -> bool:
-            tl = (t or "").lower()
-            return ("дата" in tl) and ("рожд" in tl)
-
-        if not once["dob_done"]:
-            replace_in_paragraph_keep_format(
-                p,
-                key_predicate=is_dob_line,
-                new_value=birthdate,
-                once_state_key="dob_done",
-                once_state=once,
-            )
-
-        def is_addr_line(t: str) -> bool:
-            tl = (t or "").lower()
-            return ("адрес" in tl) and ("постоянного" in tl) and ("житель" in tl)
-
-        if not once["addr_done"]:
-            replace_in_paragraph_keep_format(
-                p,
-                key_predicate=is_addr_line,
-                new_value=address,
-                once_state_key="addr_done",
-                once_state=once,
-            )
-
-
 # ------------------------
 # UI
 # ------------------------
 st.set_page_config(page_title="ПРОФПАК", layout="centered")
 st.title("ПРОФПАК")
 
-mode = st.radio("📄 Тип документа", ["Заключение предварительное", "Направление на диаскин"], horizontal=True)
+# режим сервера: задания и их очередь привязаны к сессии браузера, а введённое имя —
+# только подпись и подпапка в выбранном месте сохранения (чужое имя не даёт доступа
+# к чужим заданиям, но файлы попадут в ту же папку — имена пользователи выбирают сами)
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+user_folder = ""
+if server.CONFIG.enabled:
+    user_name = st.text_input(
+        "👤 Ваше имя или отдел:",
+        key="server_user",
+        help="Файлы сохраняются в вашу подпапку, а задания разных пользователей выполняются по очереди поровну.",
+    )
+    user_folder = server.session_namespace(user_name) if user_name.strip() else ""
+    if not user_folder:
+        st.info("Введите имя, чтобы запускать генерацию.")
+
+
+def user_path(path: Path, relative: str = "") -> Path:
+    """path / relative; на сервере — внутри подпапки пользователя, без выхода за её пределы."""
+    if not server.CONFIG.enabled:
+        return path / relative if relative else path
+    try:
+        return server.safe_subpath(path / user_folder if user_folder else path, relative)
+    except ValueError as e:
+        st.error(f"❌ {e}")
+        st.stop()
+
+
+def user_filename(name: str) -> str:
+    """Имя файла без пути: на сервере его вводят другие люди."""
+    return server.session_namespace(name) if server.CONFIG.enabled else name
+
+
+modes = st.multiselect(
+    "📄 Тип документа",
+    MODES,
+    default=MODES[:1],
+    help="Можно выбрать несколько: Excel прочитается один раз, документы каждого типа сохранятся в свою подпапку.",
+)
 
 custom_jobplace = st.text_input("💼 Введите место работы:", value="ГБОУ Школа №")
 
 save_to_fs = st.checkbox("💾 Сохранять DOCX-файлы в файловой системе", value=True)
 
+locations = build_fs_locations()
+location_labels = [f"{name} — {str(path)}" for name, path in locations]
+
 target_dir = None
+incremental = False
+remove_stale = False
 if save_to_fs:
-    locations = build_fs_locations()
-    location_labels = [f"{name} — {str(path)}" for name, path in locations]
     selected_idx = st.selectbox(
         "🌍 Куда сохранить DOCX-файлы:",
         options=list(range(len(location_labels))),
@@ -346,96 +143,266 @@ if save_to_fs:
         value="generated_docs",
         key="docx_subdir",
     )
-    target_dir = selected_path / docx_subdir if docx_subdir else selected_path
+    target_dir = user_path(selected_path, docx_subdir)
     st.info(f"DOCX-файлы сохранятся в: {target_dir}")
+    fs_writers = st.number_input(
+        "Потоков записи на диск (больше — быстрее для сетевых папок и флешек, 0 — без фоновой записи):",
+        min_value=0,
+        max_value=16,
+        value=4,
+        step=1,
+    )
+    incremental = st.checkbox("♻️ Пересоздавать только изменившиеся документы (по манифесту в папке)", value=False)
+    if incremental:
+        remove_stale = st.checkbox("🗑️ Удалять документы сотрудников, которых больше нет в Excel", value=False)
+
+save_zip = st.checkbox("🗜️ Сохранять всё одним ZIP-архивом", value=False)
+
+zip_path = None
+zip_download = False
+zip_compresslevel = 6
+zip_volume_mb = 0
+if save_zip:
+    zip_download = st.radio("Куда сохранить ZIP-архив:", ["В файловую систему", "Скачать через браузер"], horizontal=True) == "Скачать через браузер"
+    zip_filename = user_filename(st.text_input("Имя ZIP-архива (без .zip):", value="documents", key="zip_filename") or "documents")
+    if not zip_download:
+        zip_idx = st.selectbox(
+            "🌍 Куда сохранить ZIP-архив:",
+            options=list(range(len(location_labels))),
+            format_func=lambda i: location_labels[i],
+            index=0,
+            key="zip_location",
+        )
+        zip_path = user_path(locations[zip_idx][1], f"{zip_filename}.zip")
+        st.info(f"ZIP-архив сохранится в: {zip_path}")
+    zip_compresslevel = st.slider("Степень сжатия (0 — без сжатия, быстрее всего):", min_value=0, max_value=9, value=6)
+    zip_volume_mb = st.number_input("Разбивать на тома до N МБ (0 — одним архивом):", min_value=0, value=0, step=10)
+
+save_merged = st.checkbox(
+    "🖨️ Собрать один общий DOCX для печати",
+    value=False,
+    help="Все документы подряд в одном файле, каждый с новой страницы. Открывается и печатается быстрее сотен отдельных файлов.",
+)
+
+merged_dir = None
+merged_download = False
+merged_filename = "documents"
+if save_merged:
+    merged_download = st.radio("Куда сохранить общий документ:", ["В файловую систему", "Скачать через браузер"], horizontal=True, key="merged_target") == "Скачать через браузер"
+    merged_filename = user_filename(st.text_input("Имя общего документа (без .docx):", value="для_печати", key="merged_filename") or "для_печати")
+    if not merged_download:
+        merged_idx = st.selectbox(
+            "🌍 Куда сохранить общий документ:",
+            options=list(range(len(location_labels))),
+            format_func=lambda i: location_labels[i],
+            index=0,
+            key="merged_location",
+        )
+        merged_dir = user_path(locations[merged_idx][1])
+        st.info(f"Общий документ сохранится в: {merged_dir / (merged_filename + '.docx')}")
+
+if incremental and (save_zip or save_merged):
+    st.warning("♻️ В ZIP-архив и общий документ нужны все документы, поэтому генерируются все строки.")
+    incremental = remove_stale = False
+
+if server.CONFIG.enabled:
+    # на сервере процессы общие для всех — их число задаёт администратор
+    workers = 1
+elif not process_pool_allowed():
+    workers = 1
+else:
+    workers = st.number_input(
+        "⚙️ Число процессов для генерации (1 — без распараллеливания):",
+        min_value=1,
+        max_value=os.cpu_count() or 1,
+        value=default_workers(),
+        step=1,
+    )
 
-excel_file = st.file_uploader("📄 Загрузите Excel-файл с данными", type=["xlsx"])
-word_template = st.file_uploader("📄 Выберите шаблон Word", type=["docx"])
-
-save_fs_success = None
-
-if excel_file and word_template and st.button("✅ Начать генерацию"):
-    with tempfile.TemporaryDirectory() as tmpdir:
-        try:
-            tmpdir = Path(tmpdir)
-
-            excel_path = tmpdir / "data.xlsx"
-            template_path = tmpdir / "template.docx"
-            output_path = tmpdir / "docs"
-            output_path.mkdir(exist_ok=True)
-
-            excel_path.write_bytes(excel_file.read())
-            template_path.write_bytes(word_template.read())
-
-            wb = load_workbook(excel_path, data_only=True)
-            sheet = wb.active
-
-            cols = detect_columns(sheet)
-            missing = validate_columns(cols, mode)
-            if missing:
-                st.error("❌ Неверный Excel-шаблон для выбранного режима.\n\n" f"Не найдены колонки: {', '.join(missing)}")
-                st.stop()
-
-            header_row = (cols["header"] or 1) + 1
-
-            with st.spinner("⏳ Подождите, идёт генерация..."):
-                total_rows = max(sheet.max_row - header_row + 1, 1)
-                progress_bar = st.progress(0)
-
-                counter = 0
-                processed = 0
-
-                for r in range(header_row, sheet.max_row + 1):
-                    processed += 1
-
-                    fio = str(sheet.cell(row=r, column=cols["fio"]).value or "").strip()
-                    if not fio:
-                        progress_bar.progress(min(processed / total_rows, 1.0))
-                        continue
-
-                    dob_val = sheet.cell(row=r, column=cols["dob"]).value
-                    birthdate = excel_date_to_str(dob_val)
-
-                    address = ""
-                    if cols.get("address"):
-                        address = str(sheet.cell(row=r, column=cols["address"]).value or "").strip()
-
-                    position = risk = diagnosis = ""
-                    if mode == "Заключение предварительное":
-                        position = str(sheet.cell(row=r, column=cols["position"]).value or "").strip()
-                        risk = str(sheet.cell(row=r, column=cols["risk"]).value or "").strip()
-                        diagnosis = str(sheet.cell(row=r, column=cols["diagnosis"]).value or "").strip()
-
-                    dest_file = output_path / (make_safe_filename(fio) + ".docx")
-                    shutil.copy(template_path, dest_file)
-                    doc = Document(dest_file)
-
-                    if mode == "Заключение предварительное":
-                        apply_replacements_old_logic(doc, custom_jobplace, fio, birthdate, position, risk, diagnosis)
-                    else:
-                        apply_replacements_diaskin(doc, fio, birthdate, address)
-
-                    doc.save(dest_file)
-                    counter += 1
-                    progress_bar.progress(min(processed / total_rows, 1.0))
-
-            st.success(f"✅ Документы успешно созданы: {counter} файл(ов)")
-
-            if save_to_fs and target_dir is not None:
-                docs = list(output_path.glob("*.docx"))
-                if not docs:
-                    st.warning("⚠️ DOCX-файлы не были созданы (возможно, пустые строки/нет ФИО).")
-                else:
-                    with st.spinner("⏳ Копируем DOCX-файлы в файловую систему..."):
-                        target_dir.mkdir(parents=True, exist_ok=True)
-                        fs_bar = st.progress(0)
-                        for i, docx_file in enumerate(docs, start=1):
-                            shutil.copy(docx_file, target_dir / docx_file.name)
-                            fs_bar.progress(i / len(docs))
-                    save_fs_success = str(target_dir)
-
-        except Exception as e:
-            st.exception(e)
-
-if save_to_fs and save_fs_success:
-    st.success(f"DOCX-файлы сохранены в: {save_fs_success}")
+disk_cache = st.checkbox(
+    f"🗃️ Сохранять разобранные Excel-файлы в кеше на диске ({cache.default_cache_dir()})",
+    value=False,
+    help="Ускоряет повторную генерацию после перезапуска программы. В кеше остаются данные сотрудников.",
+)
+
+excel_file = st.file_uploader(
+    "📄 Загрузите Excel-файл с данными",
+    type=["xlsx", "csv", "tsv"],
+    help="CSV/TSV: кодировка UTF-8 или Windows-1251, разделитель «;», табуляция или запятая — определяются автоматически.",
+)
+word_templates = {
+    mode: st.file_uploader(f"📄 Выберите шаблон Word: {mode}" if len(modes) > 1 else "📄 Выберите шаблон Word", type=["docx"], key=f"template_{mode}")
+    for mode in modes
+}
+
+if "job_ids" not in st.session_state:
+    st.session_state.job_ids = []
+
+if len(modes) > 1 and (save_to_fs or save_zip or save_merged):
+    st.info("📁 Документы каждого типа сохранятся в свою подпапку: " + ", ".join(mode_folder(m) for m in modes))
+
+can_start = excel_file and modes and all(word_templates.values()) and (user_folder or not server.CONFIG.enabled)
+if can_start and st.button("✅ Начать генерацию"):
+    started = time.perf_counter()
+    spec = JobSpec(
+        excel_name=excel_file.name,
+        excel_bytes=excel_file.getvalue(),
+        templates=tuple((mode, template.getvalue()) for mode, template in word_templates.items()),
+        custom_jobplace=custom_jobplace,
+        target_dir=target_dir if save_to_fs else None,
+        fs_writers=int(fs_writers) if save_to_fs else 0,
+        incremental=incremental,
+        remove_stale=remove_stale,
+        save_zip=save_zip,
+        zip_path=zip_path,
+        zip_name=zip_filename if save_zip else "documents",
+        zip_compresslevel=zip_compresslevel,
+        zip_volume_mb=zip_volume_mb,
+        save_merged=save_merged,
+        merged_dir=merged_dir,
+        merged_name=merged_filename,
+        workers=int(workers),
+        disk_cache=disk_cache,
+        upload_seconds=time.perf_counter() - started,
+    )
+    try:
+        job = job_queue.submit(
+            spec,
+            label=f"{excel_file.name} — {custom_jobplace}",
+            session=st.session_state.session_id if server.CONFIG.enabled else "",
+            user=user_folder,
+        )
+    except AdmissionError as e:
+        st.error(f"❌ {e}")
+    else:
+        st.session_state.job_ids.append(job.id)
+        st.toast("📋 Задание поставлено в очередь")
+
+
+def show_run_summary(summary):
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Время", f"{summary['wall_seconds']:.1f} с")
+    c2.metric("Строк", summary["rows"])
+    c3.metric("Строк/с", summary["rows_per_second"] or "—")
+    growth = summary.get("rss_growth_mb")
+    c4.metric(
+        "Пик памяти (осн. процесс)",
+        f"{summary['peak_rss_mb']:.0f} МБ" if summary["peak_rss_mb"] is not None else "—",
+        delta=f"+{growth:.0f} МБ за запуск" if growth is not None else None,
+        delta_color="off",
+    )
+    st.caption(
+        "Память — пик основного процесса за этот запуск, без процессов рендера. "
+        "Этапы: upload — чтение загруженных файлов, workbook_load/detect_columns — открытие книги и поиск шапки, "
+        "read_rows — чтение строк, render — заполнение и упаковка DOCX (суммарно по всем процессам), "
+        "generate — ожидание очередного документа, write_* — запись, *_flush — дозапись при закрытии."
+    )
+    st.table(summary["stages"])
+    if summary.get("slowest_rows"):
+        st.markdown("**Самые медленные строки**")
+        st.table(summary["slowest_rows"])
+
+
+def show_job(job):
+    with st.container(border=True):
+        st.markdown(f"**{job.label}** · {job.mode} · {STATUS_LABELS[job.status]}")
+        if job.status == STATUS_QUEUED:
+            st.caption("Ждёт завершения предыдущих заданий" if not server.CONFIG.enabled else "Ждёт свободного места на сервере")
+        elif job.status == STATUS_RUNNING:
+            # в файлах без размеров листа total известен только приблизительно
+            known_total = f" из {job.total}" if job.total >= job.processed else ""
+            st.progress(job.fraction, text=f"Обработано строк: {job.processed}{known_total}")
+        if job.active:
+            if job.cancel_requested:
+                st.caption("⏹️ Останавливается…")
+            elif st.button("⏹️ Отменить", key=f"cancel_{job.id}"):
+                job_queue.cancel(job.id)
+                st.rerun()
+        if job.error:
+            st.error(job.error)
+        if job.status in (STATUS_DONE, STATUS_CANCELLED):
+            if job.unchanged or job.removed:
+                st.info(f"♻️ Без изменений: {job.unchanged} файл(ов), удалено устаревших: {job.removed}")
+            if job.created:
+                st.success(f"✅ Документы созданы: {job.created} файл(ов)")
+                if job.target_dir:
+                    st.success(f"DOCX-файлы сохранены в: {job.target_dir}")
+                if job.zip_volumes:
+                    st.success(f"ZIP-архив сохранён в: {', '.join(job.zip_volumes)}")
+                if job.merged_files:
+                    st.success(f"Общий документ сохранён в: {', '.join(job.merged_files)}")
+                for name, path in job.downloads:
+                    mime = DOCX_MIME if name.endswith(".docx") else "application/zip"
+                    try:
+                        with open(path, "rb") as f:
+                            st.download_button(f"⬇️ Скачать {name}", data=f, file_name=name, mime=mime, key=f"download_{job.id}_{name}")
+                    except FileNotFoundError:
+                        # срок хранения истёк между проверкой и показом
+                        pass
+                if job.downloads:
+                    st.caption(f"Файлы для скачивания хранятся {job_queue.download_ttl / 60:.0f} мин после окончания задания.")
+                elif job.downloads_expired:
+                    st.caption("⌛ Срок хранения файлов для скачивания истёк — запустите генерацию ещё раз.")
+            elif not job.unchanged:
+                st.warning("⚠️ DOCX-файлы не были созданы (возможно, пустые строки/нет ФИО).")
+        if job.summary:
+            with st.expander("📊 Статистика генерации"):
+                show_run_summary(job.summary)
+
+
+def show_jobs():
+    session_jobs = [job for job in map(job_queue.get, st.session_state.job_ids) if job is not None]
+    if not session_jobs:
+        return
+    st.subheader("📋 Задания")
+    for job in reversed(session_jobs):
+        show_job(job)
+
+
+def show_history():
+    own = set(st.session_state.job_ids)
+    # на сервере — только свои задания: в чужих ФИО и пути других пользователей
+    known = job_queue.jobs(st.session_state.session_id) if server.CONFIG.enabled else job_queue.jobs()
+    history = [job for job in known if job.id not in own and not job.active]
+    if not history:
+        return
+    with st.expander("📜 Прошлые задания"):
+        for job in history:
+            finished = time.strftime("%d.%m.%Y %H:%M", time.localtime(job.finished)) if job.finished else "—"
+            where = ", ".join(filter(None, [job.target_dir] + list(job.zip_volumes) + list(job.merged_files))) or "—"
+            st.markdown(f"{STATUS_LABELS[job.status]} **{job.label}** · {job.mode} · {finished} · создано: {job.created} · {where}")
+            if job.error:
+                st.caption(job.error)
+
+
+def show_server_status():
+    pool = server.scheduler.status()
+    queue = job_queue.status()
+    st.markdown("**🖥️ Нагрузка сервера**")
+    st.metric("Процессы рендера", f"{pool['busy']} из {pool['workers']} заняты")
+    st.metric("Задания", f"{sum(queue['running'].values())} из {queue['workers']} выполняются")
+    st.metric("В очереди заданий", sum(queue["queued"].values()))
+    # чужие сессии без имён: кто работает на сервере, другим знать не нужно
+    own = st.session_state.session_id
+    sessions = set(queue["running"]) | set(queue["queued"]) | set(pool["queued"]) | set(pool["running"])
+    others = sorted(sessions - {own})
+    if sessions:
+        st.table([
+            {
+                "Пользователь": "Вы" if session == own else f"Пользователь {others.index(session) + 1}",
+                "Выполняется": queue["running"].get(session, 0),
+                "Ждёт": queue["queued"].get(session, 0),
+                "Порций в пуле": pool["queued"].get(session, 0) + pool["running"].get(session, 0),
+            }
+            for session in ([own] if own in sessions else []) + others
+        ])
+
+
+if server.CONFIG.enabled:
+    with st.sidebar:
+        st.fragment(run_every=2.0)(show_server_status)()
+
+# пока есть незавершённые задания, панель сама обновляется раз в секунду
+polling = any(job.active for job in map(job_queue.get, st.session_state.job_ids) if job is not None)
+st.fragment(run_every=1.0 if polling else None)(show_jobs)()
+show_history()
@@ -0,0 +1,273 @@
+"""
+Бенчмарк конвейера генерации.
+
+Синтезирует Excel-файлы (100–50 000 строк, разные варианты шапки, даты рождения
+числом Excel и datetime, строки без ФИО) и шаблоны для обоих режимов, затем
+замеряет по этапам: загрузка книги, поиск колонок, чтение строк, разбор шаблона,
+заполнение, упаковка DOCX, запись в папку. Результат — JSON, который можно
+сравнить с прогоном на другом коммите (--compare).
+
+    python bench.py --rows 100 1000 10000 --output bench_results.json
+    python bench.py --rows 1000 --compare old_results.json
+"""
+from pathlib import Path
+import argparse
+import datetime
+import json
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from docx import Document
+from openpyxl import Workbook
+
+from engine import (
+    ExcelSource,
+    CompiledTemplate,
+    detect_columns_in_rows,
+    record_filename,
+    record_values,
+)
+from instrumentation import RssPeak
+from output import DirectoryOutput
+from rules import MODE_CONCLUSION, MODE_DIASKIN, MODES
+
+# ------------------------
+# Synthetic inputs
+# ------------------------
+HEADER_VARIANTS = {
+    "fio": ["ФИО сотрудника", "ФИО", "Фио работника"],
+    "dob": ["Дата рождения", "Д.р.", "др"],
+    "position": ["Штатная должность", "Должность (штатная)"],
+    "risk": ["Факторы риска", "Вредные факторы риска"],
+    "diagnosis": ["Диагноз по МКБ-10", "МКБ 10"],
+    "address": ["Адрес постоянного места жительства", "Адрес"],
+}
+
+LAST_NAMES = ["Иванов", "Петрова", "Сидоров", "Кузнецова", "Смирнов", "Попова", "Васильев", "Новикова"]
+FIRST_NAMES = ["Иван", "Мария", "Пётр", "Анна", "Сергей", "Ольга", "Алексей", "Елена"]
+
+
+def make_workbook(path, rows: int, seed: int = 0, extra_cols: int = 10, title_rows: int = 3, empty_ratio: float = 0.05):
+    """
+    Книга со случайной, но воспроизводимой шапкой: title_rows строк заголовка
+    над шапкой, колонки в перемешанном порядке, лишние колонки, пустые ФИО.
+    """
+    rnd = random.Random(seed)
+    keys = list(HEADER_VARIANTS)
+    order = keys + [f"extra{i}" for i in range(extra_cols)]
+    rnd.shuffle(order)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for i in range(title_rows):
+        ws.append([f"Список сотрудников, лист {i + 1}" if i == 0 else None])
+    ws.append([rnd.choice(HEADER_VARIANTS[k]) if k in HEADER_VARIANTS else f"Прочее {k}" for k in order])
+
+    base = datetime.datetime(1960, 1, 1)
+    for n in range(rows):
+        born = base + datetime.timedelta(days=rnd.randint(0, 40 * 365))
+        values = {
+            "fio": "" if rnd.random() < empty_ratio else f"{rnd.choice(LAST_NAMES)} {rnd.choice(FIRST_NAMES)} {n}",
+            # половина дат — datetime, половина — число Excel
+            "dob": born if n % 2 else (born - datetime.datetime(1899, 12, 30)).days,
+            "position": rnd.choice(["Учитель", "Повар", "Водитель", "Лаборант"]),
+            "risk": f"{rnd.randint(1, 5)}.{rnd.randint(1, 9)}",
+            "diagnosis": rnd.choice(["Z00.0", "J45", "I10", ""]),
+            "address": f"г. Москва, ул. Ленина, д. {rnd.randint(1, 200)}",
+        }
+        ws.append([values.get(k, rnd.randint(0, 1000)) for k in order])
+    wb.save(path)
+
+
+def _field(paragraph, label: str, width: int = 30):
+    paragraph.add_run(label)
+    run = paragraph.add_run(" " * width)
+    run.font.underline = True
+
+
+def make_template(path, mode: str, filler_paragraphs: int = 40):
+    doc = Document()
+    if mode == MODE_CONCLUSION:
+        doc.add_heading("ЗАКЛЮЧЕНИЕ ПРЕДВАРИТЕЛЬНОГО МЕДИЦИНСКОГО ОСМОТРА", level=1)
+        for text in [
+            "1. Ф.И.О: ____________",
+            "2. Место работы: ____________",
+            "3. Профессия (должность) (в настоящее время): ____________",
+            "4. Стаж работы: ____________",
+            "Вредный производственный фактор: ____________",
+        ]:
+            doc.add_paragraph(text)
+        table = doc.add_table(rows=3, cols=2)
+        table.cell(0, 0).text = "5. Заключение"
+        table.cell(1, 0).merge(table.cell(1, 1)).text = "6. Наименование: ____________"
+        table.cell(2, 0).text = "Подпись врача"
+    else:
+        doc.add_heading("НАПРАВЛЕНИЕ НА ДИАСКИНТЕСТ", level=1)
+        _field(doc.add_paragraph(), "Ф.И.О.: ")
+        _field(doc.add_paragraph(), "Дата рождения: ", 14)
+        _field(doc.add_paragraph(), "Адрес постоянного места жительства: ", 40)
+        table = doc.add_table(rows=2, cols=2)
+        _field(table.cell(0, 0).paragraphs[0], "Дата рождения: ", 10)
+        _field(table.cell(1, 0).merge(table.cell(1, 1)).paragraphs[0], "Подпись направившего врача: ")
+    for i in range(filler_paragraphs):
+        doc.add_paragraph(f"Пункт {i + 1}. Текст шаблона, который не заполняется.")
+    doc.save(path)
+
+
+# ------------------------
+# Measurement
+# ------------------------
+class Stages:
+    """Накопление времени по этапам (этап может вызываться много раз)."""
+
+    def __init__(self):
+        self.seconds = {}
+
+    def add(self, name: str, started: float):
+        self.seconds[name] = self.seconds.get(name, 0.0) + (time.perf_counter() - started)
+
+
+def run_case(workdir: Path, rows: int, mode: str, seed: int, trace_memory: bool):
+    excel_path = workdir / f"data_{rows}.xlsx"
+    template_path = workdir / f"template_{MODES.index(mode)}.docx"
+    if not excel_path.exists():
+        make_workbook(excel_path, rows, seed=seed)
+    if not template_path.exists():
+        make_template(template_path, mode)
+    out_dir = workdir / f"out_{rows}_{MODES.index(mode)}"
+
+    if trace_memory:
+        tracemalloc.start()
+    stages = Stages()
+    # все случаи идут в одном процессе: пик за время жизни процесса достался бы от самого большого
+    memory = RssPeak()
+    total = time.perf_counter()
+
+    t = time.perf_counter()
+    source = ExcelSource(excel_path)
+    stages.add("workbook_load", t)
+
+    # ExcelSource уже нашёл шапку; повторяем поиск отдельно, чтобы замерить только его
+    t = time.perf_counter()
+    cols = detect_columns_in_rows(source._head)
+    stages.add("detect_columns", t)
+
+    t = time.perf_counter()
+    compiled = CompiledTemplate(template_path.read_bytes(), mode)
+    stages.add("template_compile", t)
+
+    out = DirectoryOutput(out_dir)
+    docs = 0
+    records = source.records(mode)
+    while True:
+        t = time.perf_counter()
+        record = next(records, StopIteration)
+        stages.add("read_rows", t)
+        if record is StopIteration:
+            break
+        if record is None:
+            continue
+
+        t = time.perf_counter()
+        element = compiled.render_element(record_values(record, "ГБОУ Школа № 1"))
+        stages.add("fill", t)
+
+        t = time.perf_counter()
+        data = compiled.pack(element)
+        stages.add("save", t)
+
+        t = time.perf_counter()
+        out.write(record_filename(record), data)
+        stages.add("write_target", t)
+        memory.sample()
+        docs += 1
+
+    t = time.perf_counter()
+    out.close()
+    source.close()
+    stages.add("write_target", t)
+    total = time.perf_counter() - total
+    memory.sample(force=True)
+
+    result = {
+        "rows": rows,
+        "mode": mode,
+        "docs": docs,
+        "columns": cols,
+        "total_seconds": round(total, 4),
+        "rows_per_second": round(rows / total, 1) if total else None,
+        "stages": {name: round(sec, 4) for name, sec in stages.seconds.items()},
+        "rss_start_mb": round(memory.start_mb, 1) if memory.start_mb is not None else None,
+        "peak_rss_mb": round(memory.peak_mb, 1) if memory.peak_mb is not None else None,
+        "rss_growth_mb": round(memory.growth_mb, 1) if memory.growth_mb is not None else None,
+    }
+    if trace_memory:
+        result["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+        tracemalloc.stop()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline_path: Path):
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    old = {(r["rows"], r["mode"]): r for r in baseline["runs"]}
+    print(f"\nСравнение с {baseline_path} ({baseline['meta'].get('commit')}):")
+    for run in current["runs"]:
+        prev = old.get((run["rows"], run["mode"]))
+        if not prev:
+            continue
+        print(f"  {run['mode']}, {run['rows']} строк: {prev['total_seconds']:.2f}s -> {run['total_seconds']:.2f}s ({run['total_seconds'] / prev['total_seconds']:.2f}x)")
+        for name, sec in run["stages"].items():
+            if prev["stages"].get(name):
+                print(f"    {name:<16} {prev['stages'][name]:.3f}s -> {sec:.3f}s ({sec / prev['stages'][name]:.2f}x)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк генерации документов ПРОФПАК")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=[MODE_CONCLUSION, MODE_DIASKIN])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=Path("bench_results.json"))
+    parser.add_argument("--workdir", type=Path, help="папка для входных/выходных файлов (по умолчанию временная)")
+    parser.add_argument("--trace-memory", action="store_true", help="пик памяти Python по tracemalloc (замедляет прогон)")
+    parser.add_argument("--compare", type=Path, help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args(argv)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started": datetime.datetime.now().isoformat(timespec="seconds"),
+            "seed": args.seed,
+        },
+        "runs": [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or Path(tmp)
+        workdir.mkdir(parents=True, exist_ok=True)
+        for rows in args.rows:
+            for mode in args.modes:
+                run = run_case(workdir, rows, mode, args.seed, args.trace_memory)
+                results["runs"].append(run)
+                print(f"{mode}, {rows} строк: {run['total_seconds']:.2f}s, {run['rows_per_second']} строк/с")
+
+    args.output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Результаты: {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+import hashlib
+import logging
+import os
+import pickle
+import threading
+
+from engine import CompiledTemplate, open_table, project_record, table_kind
+
+logger = logging.getLogger(__name__)
+
+# увеличивать при любом изменении разбора строк: записи старых версий не читаются
+# 2 — даты текстом приводятся к dd.mm.yyyy, разделитель CSV — по шапке
+CACHE_VERSION = 2
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def default_cache_dir() -> Path:
+    if os.name == "nt" and os.environ.get("LOCALAPPDATA"):
+        return Path(os.environ["LOCALAPPDATA"]) / "ПРОФПАК" / "cache"
+    return Path.home() / ".cache" / "profpak"
+
+
+# ------------------------
+# Storage tiers
+# ------------------------
+class LRUCache:
+    """Потокобезопасный LRU с ограничением по суммарному размеру (sizeof) и числу записей."""
+
+    def __init__(self, max_bytes: int, max_entries: int = 64):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, size: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._items[key] = (value, size)
+            self._size += size
+            while self._items and (self._size > self.max_bytes or len(self._items) > self.max_entries):
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self._size -= evicted_size
+
+
+class DiskCache:
+    """
+    Кеш в файлах (pickle), переживает перезапуск приложения.
+    Старые файлы удаляются, когда суммарный размер превышает max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.v{CACHE_VERSION}.pkl"
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("Broken cache file %s, removing", path, exc_info=True)
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)
+        return value
+
+    def put(self, key: str, value):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        self._trim()
+
+    def _trim(self):
+        current = f".v{CACHE_VERSION}.pkl"
+        for p in self.directory.glob("*.pkl"):
+            if not p.name.endswith(current):
+                p.unlink(missing_ok=True)
+        files = sorted(self.directory.glob("*.pkl"), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        for p in files:
+            if total <= self.max_bytes:
+                break
+            total -= p.stat().st_size
+            p.unlink(missing_ok=True)
+
+
+# ------------------------
+# Parsed workbooks
+# ------------------------
+class CachedSheet:
+    """Разобранный лист из кеша: тот же интерфейс, что у ExcelSource."""
+
+    def __init__(self, cols: dict, total_rows: int, records: list):
+        self.cols = cols
+        self.total_rows = total_rows
+        self._records = records
+        self.timings = {}
+
+    def records(self, mode: str, batch_size: int = 256):
+        for record in self._records:
+            yield project_record(record, mode)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _record_size(record) -> int:
+    # грубая оценка: строки + накладные расходы кортежа
+    if record is None:
+        return 120
+    return 200 + 2 * sum(len(v) for v in record[1:])
+
+
+class _RecordingSource:
+    """
+    ExcelSource/CsvSource, который по ходу чтения складывает записи для кеша.
+    В кеш попадает только полностью прочитанный лист и только если он влезает в лимит.
+    """
+
+    def __init__(self, source, key: str, cache: "WorkbookCache", use_disk: bool):
+        self._source = source
+        self._key = key
+        self._cache = cache
+        self._use_disk = use_disk
+        self.cols = source.cols
+        self.total_rows = source.total_rows
+        self.timings = source.timings
+
+    def records(self, mode: str, batch_size: int = 256):
+        collected = []
+        size = 0
+        for record in self._source.records(None, batch_size):
+            if collected is not None:
+                collected.append(record)
+                size += _record_size(record)
+                if size > self._cache.max_bytes:
+                    collected = None
+            yield project_record(record, mode)
+        if collected is not None:
+            self._cache.store(self._key, CachedSheet(self.cols, self.total_rows, collected), size, self._use_disk)
+
+    def close(self):
+        self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class WorkbookCache:
+    """
+    Разобранные Excel-файлы по SHA-256 содержимого: карта колонок + нормализованные строки.
+    Память — LRU до max_bytes; опционально диск (disk_dir).
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, disk_dir=None, disk_max_bytes: int = 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._memory = LRUCache(max_bytes)
+        self.disk = DiskCache(disk_dir, disk_max_bytes) if disk_dir else None
+
+    def open(self, data: bytes, use_disk: bool = False, filename: str = ""):
+        """
+        Источник строк для data: из кеша или потоковое чтение с записью в кеш.
+        filename — имя загруженного файла: по расширению выбирается xlsx или CSV/TSV.
+        """
+        # одни и те же байты читаются по-разному как .csv и как .tsv
+        key = f"{sha256_bytes(data)}-{table_kind(filename)}"
+        sheet = self._memory.get(key)
+        if sheet is None and use_disk and self.disk is not None:
+            sheet = self.disk.get(key)
+            if sheet is not None:
+                self._memory.put(key, sheet, sum(_record_size(r) for r in sheet._records))
+        if sheet is not None:
+            return sheet
+        return _RecordingSource(open_table(BytesIO(data), filename), key, self, use_disk)
+
+    def store(self, key: str, sheet: CachedSheet, size: int, use_disk: bool = False):
+        self._memory.put(key, sheet, size)
+        if use_disk and self.disk is not None:
+            try:
+                self.disk.put(key, sheet)
+            except OSError:
+                logger.warning("Could not write workbook cache to disk", exc_info=True)
+
+
+# ------------------------
+# Compiled templates
+# ------------------------
+class TemplateCache:
+    """
+    Разобранные шаблоны по (SHA-256, режим). Только в памяти: CompiledTemplate
+    держит XML-дерево lxml, а разбор одного шаблона и так дешёвый.
+    """
+
+    def __init__(self, max_entries: int = 8):
+        self._memory = LRUCache(max_bytes=1 << 62, max_entries=max_entries)
+
+    def get(self, data: bytes, mode: str) -> CompiledTemplate:
+        key = (sha256_bytes(data), mode)
+        compiled = self._memory.get(key)
+        if compiled is None:
+            compiled = CompiledTemplate(data, mode)
+            self._memory.put(key, compiled, len(data))
+        return compiled
+
+
+# общие для всех перезапусков скрипта Streamlit (модуль импортируется один раз на процесс)
+workbooks = WorkbookCache(disk_dir=default_cache_dir())
+templates = TemplateCache()
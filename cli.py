@@ -0,0 +1,141 @@
+"""
+Генерация документов из командной строки — без Streamlit и веб-интерфейса.
+
+    python cli.py сотрудники.xlsx шаблон.docx --mode diaskin --jobplace "ГБОУ Школа № 1" --output-dir out
+    python cli.py сотрудники.xlsx шаблон.docx --mode conclusion --jobplace "ООО Ромашка" --zip out/ромашка.zip
+
+Несколько шаблонов за один проход по Excel — по одному --mode на каждый шаблон,
+в том же порядке; документы каждого режима пишутся в свою подпапку:
+
+    python cli.py сотрудники.xlsx заключение.docx диаскин.docx --mode conclusion --mode diaskin --output-dir out
+
+Тяжёлые модули (python-docx, openpyxl, lxml) импортируются только после разбора
+аргументов, поэтому --help и ошибки в аргументах отрабатывают мгновенно.
+Код возврата: 0 — успех, 1 — в Excel нет нужных колонок, 2 — неверные аргументы.
+
+В сборке для Windows это отдельный консольный ПРОФПАК-cli.exe рядом с ПРОФПАК.exe
+(без streamlit, запускается быстро); в нём по умолчанию один процесс, --workers N включает пул.
+"""
+from pathlib import Path
+import argparse
+import json
+import logging
+import multiprocessing
+import sys
+
+from rules import MODE_CONCLUSION, MODE_DIASKIN, MODES
+
+MODE_ALIASES = {
+    "conclusion": MODE_CONCLUSION,
+    "diaskin": MODE_DIASKIN,
+}
+
+
+def parse_mode(value: str) -> str:
+    mode = MODE_ALIASES.get(value.lower(), value)
+    if mode not in MODES:
+        raise argparse.ArgumentTypeError(f"неизвестный режим {value!r}; варианты: {', '.join(list(MODE_ALIASES) + MODES)}")
+    return mode
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="ПРОФПАК: генерация документов по Excel и шаблону Word")
+    parser.add_argument("excel", type=Path, help="файл с данными: xlsx, csv или tsv")
+    parser.add_argument("templates", type=Path, nargs="+", metavar="template", help="шаблон Word (docx); можно несколько")
+    parser.add_argument(
+        "--mode",
+        dest="modes",
+        type=parse_mode,
+        action="append",
+        required=True,
+        help="conclusion | diaskin (или полное название режима); по одному на каждый шаблон",
+    )
+    parser.add_argument("--jobplace", default="", help="место работы для подстановки в документы")
+    parser.add_argument("--output-dir", type=Path, help="папка для DOCX-файлов")
+    parser.add_argument("--zip", type=Path, help="путь к ZIP-архиву")
+    parser.add_argument("--merged", type=Path, help="один общий DOCX для печати (при нескольких режимах — имя_<режим>.docx)")
+    parser.add_argument("--compresslevel", type=int, default=6, choices=range(10), metavar="0-9", help="сжатие ZIP (0 — без сжатия)")
+    parser.add_argument("--volume-mb", type=float, default=0, help="делить ZIP на тома не больше N МБ")
+    parser.add_argument("--workers", type=int, help="число процессов генерации (по умолчанию — по числу ядер, в собранном EXE — 1)")
+    parser.add_argument("--fs-writers", type=int, default=4, help="потоков записи в папку (0 — запись в основном потоке)")
+    parser.add_argument("--incremental", action="store_true", help="пересоздавать только изменившиеся строки (нужен --output-dir)")
+    parser.add_argument("--remove-stale", action="store_true", help="с --incremental: удалять документы строк, которых больше нет")
+    parser.add_argument("--metrics-json", type=Path, help="записать статистику запуска в JSON-файл")
+    parser.add_argument("-v", "--verbose", action="store_true", help="подробный лог (в т.ч. JSON-статистика по этапам)")
+    return parser
+
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if len(args.modes) != len(args.templates):
+        parser.error(f"шаблонов: {len(args.templates)}, режимов (--mode): {len(args.modes)} — нужно поровну")
+    if len(set(args.modes)) != len(args.modes):
+        parser.error("каждый режим можно указать только один раз")
+    if args.output_dir is None and args.zip is None and args.merged is None:
+        parser.error("укажите --output-dir, --zip и/или --merged")
+    if args.incremental and (args.output_dir is None or args.zip is not None or args.merged is not None):
+        # в архив и общий документ нужны все строки, а не только изменившиеся
+        parser.error("--incremental работает только с --output-dir (без --zip и --merged)")
+    if args.remove_stale and not args.incremental:
+        parser.error("--remove-stale работает только с --incremental")
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr)
+
+    from engine import CompiledTemplate, default_workers, open_table
+    from instrumentation import RunMetrics
+    from output import MergedDocxOutput, ZipOutput
+    from pipeline import MissingColumnsError, make_targets, require_columns, run_targets
+
+    metrics = RunMetrics(label=", ".join(args.modes))
+    with metrics.stage("upload"):
+        templates = [path.read_bytes() for path in args.templates]
+    with metrics.stage("template_compile"):
+        compiled = [CompiledTemplate(data, mode) for data, mode in zip(templates, args.modes)]
+
+    with open_table(args.excel) as source:
+        try:
+            require_columns(source.cols, *args.modes)
+        except MissingColumnsError as e:
+            print(f"{args.excel}: {e}", file=sys.stderr)
+            return 1
+
+        zip_output = None
+        if args.zip is not None:
+            zip_output = ZipOutput(args.zip, compresslevel=args.compresslevel, volume_mb=args.volume_mb)
+        targets = make_targets(
+            list(zip(args.modes, templates, compiled)),
+            target_dir=args.output_dir,
+            zip_output=zip_output,
+            fs_writers=args.fs_writers,
+            incremental=args.incremental,
+            merged=(args.merged.parent, args.merged.stem) if args.merged is not None else None,
+        )
+        stats = run_targets(
+            source,
+            targets,
+            args.jobplace,
+            workers=args.workers or default_workers(),
+            remove_stale=args.remove_stale,
+            metrics=metrics,
+        )
+
+    summary = metrics.summary()
+    print(f"Строк: {stats.processed}, создано: {stats.created}, без изменений: {stats.unchanged}, удалено: {stats.removed} ({summary['wall_seconds']:.1f} с)")
+    if args.output_dir is not None:
+        print(f"Папка: {args.output_dir}")
+    if zip_output is not None:
+        print("ZIP: " + ", ".join(str(p) for p in zip_output.volumes))
+    for target in targets:
+        for _, out, _ in target.outputs:
+            if isinstance(out, MergedDocxOutput):
+                print(f"Общий документ: {out.result}")
+    if args.metrics_json is not None:
+        args.metrics_json.write_text(json.dumps({**summary, **stats._asdict()}, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    # в собранном ПРОФПАК-cli.exe дочерние процессы пула (--workers) запускают этот же EXE
+    multiprocessing.freeze_support()
+    sys.exit(main())
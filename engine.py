@@ -0,0 +1,1108 @@
+from docx import Document
+from docx.document import Document as DocxDocument
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
+from openpyxl import load_workbook
+from openpyxl.utils.datetime import from_excel
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, defaultdict, deque
+from pathlib import Path
+import logging
+import codecs
+import csv
+import datetime
+import hashlib
+import io
+import os
+import pickle
+import re
+import sys
+import tempfile
+import time
+import zipfile
+from typing import NamedTuple, Optional
+from copy import deepcopy
+from io import BytesIO
+
+from rules import HEADER_INDEX, HEADER_RULES, MODE_RULES, PARAGRAPH_INDEXES
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------
+# Excel parsing
+# ------------------------
+HEADER_SCAN_ROWS = 20
+HEADER_SCAN_COLS = 79
+
+
+def detect_columns(sheet):
+    rows = sheet.iter_rows(min_row=1, max_row=HEADER_SCAN_ROWS, max_col=HEADER_SCAN_COLS, values_only=True)
+    return detect_columns_in_rows(rows)
+
+
+def detect_columns_in_rows(rows):
+    """Поиск шапки по первым строкам листа (кортежи значений ячеек, начиная с 1-й строки)."""
+    cols = {rule.key: None for rule in HEADER_RULES}
+    cols["header"] = None
+
+    for r, cells in enumerate(rows, start=1):
+        if r > HEADER_SCAN_ROWS:
+            break
+        for c, val in enumerate(cells[:HEADER_SCAN_COLS], start=1):
+            if not isinstance(val, str):
+                continue
+
+            matches = HEADER_INDEX.classify(val.strip().lower())
+            # ячейка под несколько полей сразу — это не шапка (например, CSV прочитан
+            # с чужим разделителем и вся строка попала в одну ячейку)
+            if len(matches) > 1:
+                continue
+            for key, sets_header in matches:
+                cols[key] = cols[key] or c
+                if sets_header:
+                    cols["header"] = cols["header"] or r
+
+    return cols
+
+
+def validate_columns(cols: dict, mode: str):
+    return [k for k in MODE_RULES[mode].required if not cols.get(k)]
+
+
+def excel_date_to_str(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%d.%m.%Y")
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day).strftime("%d.%m.%Y")
+    if isinstance(value, (int, float)):
+        try:
+            return from_excel(value).strftime("%d.%m.%Y")
+        except Exception:
+            return str(value)
+    if isinstance(value, str):
+        return text_date_to_str(value)
+    return str(value)
+
+
+# дата текстом: 01.05.1980, 1.5.1980, 01/05/1980, 1980-05-01, в т.ч. со временем после даты
+_TEXT_DATE_DMY = re.compile(r"^(\d{1,2})[./-](\d{1,2})[./-](\d{4})(?:[ T].*)?$")
+_TEXT_DATE_ISO = re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})(?:[ T].*)?$")
+
+
+def text_date_to_str(text: str) -> str:
+    """Дата, записанная текстом (CSV, текстовые ячейки Excel) -> dd.mm.yyyy; иначе текст как есть."""
+    text = text.strip()
+    m = _TEXT_DATE_DMY.match(text)
+    if m:
+        day, month, year = m.groups()
+    else:
+        m = _TEXT_DATE_ISO.match(text)
+        if not m:
+            return text
+        year, month, day = m.groups()
+    try:
+        return datetime.date(int(year), int(month), int(day)).strftime("%d.%m.%Y")
+    except ValueError:
+        return text
+
+
+def make_safe_filename(text: str) -> str:
+    return re.sub(r"[^\w\-_. ]", "_", text.strip())
+
+
+# поля, которые читаются только в режимах, где они обязательны
+OPTIONAL_FIELDS = ("position", "risk", "diagnosis")
+
+
+def cell_to_str(value) -> str:
+    return str(value or "").strip()
+
+
+class RowRecord(NamedTuple):
+    """Нормализованные значения одной строки Excel (row — номер строки на листе)."""
+
+    row: int
+    fio: str
+    birthdate: str
+    position: str
+    risk: str
+    diagnosis: str
+    address: str
+
+
+def normalize_rows(batch, cols: dict, mode: str):
+    """
+    Порция сырых строк [(номер, кортеж ячеек), ...] -> RowRecord | None (нет ФИО).
+    Нормализация идёт по колонкам: один проход с одним преобразованием на колонку.
+    mode=None — заполняются все колонки (запись годится для любого режима, см. project_record).
+    """
+
+    def column(key, convert):
+        col = cols.get(key)
+        if not col:
+            return [""] * len(batch)
+        i = col - 1
+        return [convert(cells[i] if i < len(cells) else None) for _, cells in batch]
+
+    fio = column("fio", cell_to_str)
+    birthdate = column("dob", excel_date_to_str)
+    address = column("address", cell_to_str)
+    # колонки, не нужные режиму, не читаем
+    needed = MODE_RULES[mode].required if mode is not None else OPTIONAL_FIELDS
+    position, risk, diagnosis = (column(key, cell_to_str) if key in needed else [""] * len(batch) for key in OPTIONAL_FIELDS)
+
+    for i, (r, _) in enumerate(batch):
+        if not fio[i]:
+            yield None
+            continue
+        yield RowRecord(r, fio[i], birthdate[i], position[i], risk[i], diagnosis[i], address[i])
+
+
+def project_record(record, mode: str):
+    """Запись, прочитанная с mode=None, -> такая же, как если бы читали в режиме mode."""
+    if record is None or mode is None:
+        return record
+    required = MODE_RULES[mode].required
+    dropped = {key: "" for key in OPTIONAL_FIELDS if key not in required}
+    return record._replace(**dropped) if dropped else record
+
+
+class _TableSource:
+    """
+    Общая часть источников строк: шапка ищется по первым HEADER_SCAN_ROWS строкам
+    (self._head), остальные строки читаются лениво из self._rows.
+    """
+
+    @property
+    def first_data_row(self) -> int:
+        return (self.cols["header"] or 1) + 1
+
+    @property
+    def total_rows(self) -> int:
+        """Число строк данных по размеру листа (для прогресса)."""
+        return max(self.max_row - self.first_data_row + 1, 0)
+
+    def _read_head(self):
+        self._head = []
+        for cells in self._rows:
+            self._head.append(cells)
+            if len(self._head) >= HEADER_SCAN_ROWS:
+                break
+
+    def raw_rows(self):
+        """(номер строки, кортеж ячеек) для всех строк после шапки."""
+        start = self.first_data_row
+        for r, cells in enumerate(self._head, start=1):
+            if r >= start:
+                yield r, cells
+        for r, cells in enumerate(self._rows, start=len(self._head) + 1):
+            if r >= start:
+                yield r, cells
+
+    def records(self, mode: str, batch_size: int = 256):
+        batch = []
+        for item in self.raw_rows():
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield from normalize_rows(batch, self.cols, mode)
+                batch = []
+        if batch:
+            yield from normalize_rows(batch, self.cols, mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ExcelSource(_TableSource):
+    """
+    Потоковое чтение активного листа xlsx (openpyxl read-only).
+
+    Шапка ищется по первым HEADER_SCAN_ROWS строкам, дальше строки читаются
+    лениво и отдаются порциями через records(), поэтому память не зависит от
+    размера листа. Файл нужно закрыть (close() или with).
+    path — путь или файловый объект (BytesIO).
+    """
+
+    def __init__(self, path):
+        started = time.perf_counter()
+        self._wb = load_workbook(path, read_only=True, data_only=True)
+        sheet = self._wb.active
+        self._rows = sheet.iter_rows(values_only=True)
+        self._read_head()
+        loaded = time.perf_counter()
+        self.cols = detect_columns_in_rows(self._head)
+        # время открытия для статистики запуска (этапы load и detect)
+        self.timings = {"workbook_load": loaded - started, "detect_columns": time.perf_counter() - loaded}
+        self.max_row = sheet.max_row or 0
+        if self.max_row <= len(self._head) and len(self._head) >= HEADER_SCAN_ROWS:
+            # в листе нет <dimension> (или там "A1") — иначе прогресс видел бы только
+            # шапку; строки считаются по тегам, без разбора ячеек
+            counted = time.perf_counter()
+            try:
+                # _archive и _worksheet_path — внутренние атрибуты openpyxl (read-only);
+                # если их нет в другой версии, остаётся число строк из <dimension>
+                self.max_row = max(self._count_sheet_rows(self._wb._archive, sheet._worksheet_path), len(self._head))
+            except (AttributeError, KeyError):
+                logger.warning("Cannot count rows of a sheet without dimension, progress will be approximate", exc_info=True)
+            self.timings["count_rows"] = time.perf_counter() - counted
+        self.max_row = max(self.max_row, len(self._head))
+
+    @staticmethod
+    def _count_sheet_rows(archive, member: str) -> int:
+        """Номер последней строки листа по тегам <row> в XML (r="..." или их число)."""
+        last = count = 0
+        tail = b""
+        with archive.open(member) as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                data = tail + chunk
+                # незакрытый тег на границе порции переносится в следующую
+                cut = data.rfind(b"<")
+                if cut != -1 and data.find(b">", cut) == -1:
+                    data, tail = data[:cut], data[cut:]
+                else:
+                    tail = b""
+                for m in _SHEET_ROW.finditer(data):
+                    count += 1
+                    if m.group(1):
+                        last = int(m.group(1))
+        return max(last, count)
+
+    def close(self):
+        self._wb.close()
+
+
+_SHEET_ROW = re.compile(rb'<(?:\w+:)?row\b(?:[^>]*?\br="(\d+)")?')
+
+CSV_SUFFIXES = (".csv", ".tsv")
+# порядок — приоритет при равенстве: выгрузки из 1С и Excel (ru) обычно через ";"
+CSV_DELIMITERS = (";", "\t", ",")
+
+
+def detect_text_encoding(sample: bytes) -> str:
+    """UTF-8 (с BOM или без), UTF-16 (Excel: "Текст Юникод") или cp1251."""
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        # final=False: образец мог оборваться посреди многобайтного символа
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return "cp1251"
+    return "utf-8"
+
+
+DELIMITER_SCAN_ROWS = 100
+
+
+def detect_delimiter(sample_text: str) -> str:
+    """
+    Разделитель, с которым находится больше полей шапки; если шапка не нашлась ни с одним —
+    тот, что делит строки на одинаковое (больше одного) число полей чаще остальных.
+    Считать сами символы нельзя: запятые бывают внутри значений ("п. 4.1, 4.2").
+    """
+    def score(delimiter):
+        rows = []
+        for row in csv.reader(io.StringIO(sample_text, newline=""), delimiter=delimiter):
+            rows.append(row)
+            if len(rows) > DELIMITER_SCAN_ROWS:
+                break
+        if len(rows) > 1:
+            # последняя строка образца могла оборваться
+            rows.pop()
+        cols = detect_columns_in_rows([tuple(row) for row in rows[:HEADER_SCAN_ROWS]])
+        found = sum(1 for rule in HEADER_RULES if cols[rule.key])
+        widths = [len(row) for row in rows if len(row) > 1]
+        consistent = max((widths.count(w) for w in set(widths)), default=0)
+        return found, consistent
+
+    scores = {d: score(d) for d in CSV_DELIMITERS}
+    # max() берёт первый из равных — порядок CSV_DELIMITERS задаёт приоритет
+    best = max(CSV_DELIMITERS, key=lambda d: scores[d])
+    return best if any(scores[best]) else CSV_DELIMITERS[0]
+
+
+class CsvSource(_TableSource):
+    """
+    Потоковое чтение CSV/TSV — тот же интерфейс, что у ExcelSource.
+
+    Кодировка (UTF-8/UTF-16/cp1251) и разделитель (";", табуляция, ",") определяются
+    по началу файла; для .tsv разделитель — табуляция. Все ячейки — строки; даты
+    текстом приводятся к dd.mm.yyyy так же, как текстовые даты в Excel.
+    path — путь или двоичный файловый объект (BytesIO); filename — имя для расширения.
+    """
+
+    SAMPLE_SIZE = 64 * 1024
+
+    def __init__(self, path, filename: str = ""):
+        started = time.perf_counter()
+        if isinstance(path, (str, Path)):
+            filename = filename or str(path)
+            raw = open(path, "rb")
+        else:
+            raw = path
+        sample = raw.read(self.SAMPLE_SIZE)
+        self.encoding = detect_text_encoding(sample)
+        if Path(filename).suffix.lower() == ".tsv":
+            self.delimiter = "\t"
+        else:
+            self.delimiter = detect_delimiter(sample.decode(self.encoding, errors="ignore"))
+        line_count = self._count_lines(raw, sample)
+        raw.seek(0)
+
+        self._text = io.TextIOWrapper(raw, encoding=self.encoding, newline="")
+        self._rows = (tuple(row) for row in csv.reader(self._text, delimiter=self.delimiter))
+        self._read_head()
+        loaded = time.perf_counter()
+        self.cols = detect_columns_in_rows(self._head)
+        self.max_row = max(line_count, len(self._head))
+        self.timings = {"workbook_load": loaded - started, "detect_columns": time.perf_counter() - loaded}
+
+    @staticmethod
+    def _count_lines(raw, sample: bytes) -> int:
+        # приблизительно (переводы строк внутри кавычек тоже считаются) — только для прогресса
+        count = sample.count(b"\n")
+        for chunk in iter(lambda: raw.read(1024 * 1024), b""):
+            count += chunk.count(b"\n")
+        return count + 1
+
+    def close(self):
+        self._text.close()
+
+
+def table_kind(filename: str) -> str:
+    """"csv", "tsv" или "xlsx" — как open_table прочитает файл с таким именем."""
+    suffix = Path(filename).suffix.lower()
+    return suffix[1:] if suffix in CSV_SUFFIXES else "xlsx"
+
+
+def open_table(path, filename: str = ""):
+    """ExcelSource или CsvSource по расширению filename (или пути)."""
+    name = filename or (str(path) if isinstance(path, (str, Path)) else "")
+    if table_kind(name) != "xlsx":
+        return CsvSource(path, filename)
+    return ExcelSource(path)
+
+
+# ------------------------
+# DOCX replacement helpers
+# ------------------------
+def iter_all_paragraphs(doc: Document):
+    for p in doc.paragraphs:
+        yield p
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                for p in cell.paragraphs:
+                    yield p
+
+
+def _is_field_run(run) -> bool:
+    """
+    Определяем run, который является "полем" с линией.
+    Для твоего шаблона это обычно:
+    - underline=True и текст пустой/пробелы
+    - или очень много пробелов/подчёркиваний
+    """
+    t = run.text or ""
+    stripped = t.strip()
+
+    # если подчёркнут и это пробелы/пустота — это почти точно поле
+    if getattr(run.font, "underline", None):
+        if stripped == "" and len(t) >= 2:
+            return True
+
+    # поле может быть без underline на самом run (underline в стиле),
+    # но текст тогда длинный и пробельный
+    if stripped == "" and len(t) >= 8:
+        return True
+
+    # поле из "_" (редко, но поддержим)
+    if t.count("_") >= 5:
+        return True
+
+    return False
+
+
+def fill_underlined_field_run(field_run, value: str):
+    """
+    Заполняем подчёркнутое поле:
+    value + хвост NBSP до исходной длины run.
+    NBSP нужен, чтобы Word не схлопывал пробелы.
+    """
+    original = field_run.text or ""
+    original_len = len(original)
+
+    NBSP = "\u00A0"
+
+    value = value or ""
+
+    # Гарантируем подчёркивание на поле (если оно было на стиле/частично, это не мешает)
+    field_run.font.underline = True
+
+    # Если value длиннее поля — не режем молча: поле расширится.
+    # Если хочешь строго по длине, раскомментируй:
+    # if len(value) > original_len:
+    #     value = value[:original_len]
+
+    pad_len = max(0, original_len - len(value))
+    field_run.text = value + (NBSP * pad_len)
+
+
+def locate_field_run(paragraph):
+    """
+    Находим, куда в строке подставлять значение (без изменения документа):
+    - ("run", i) — индекс run-поля (подчёркнутые пробелы)
+    - ("prefix", "Текст до двоеточия:") — fallback, когда поля нет
+    - None — подставить некуда
+    """
+    for i, run in enumerate(paragraph.runs):
+        if _is_field_run(run):
+            return ("run", i)
+
+    full_text = paragraph.text or ""
+    if ":" in full_text:
+        return ("prefix", full_text.split(":", 1)[0] + ":")
+    return None
+
+
+def fill_field(paragraph, slot, new_value):
+    kind, target = slot
+    if kind == "run":
+        fill_underlined_field_run(paragraph.runs[target], str(new_value or ""))
+        return
+
+    # fallback: заменить после двоеточия (может убрать линию, но лучше чем ничего)
+    for run in paragraph.runs:
+        run.text = ""
+    if paragraph.runs:
+        paragraph.runs[0].text = f"{target} {new_value}"
+    else:
+        paragraph.add_run(f"{target} {new_value}")
+
+
+def replace_whole_paragraph(paragraph, value: str):
+    for run in paragraph.runs:
+        run.text = ""
+    if paragraph.runs:
+        paragraph.runs[0].text = value
+    else:
+        paragraph.add_run(value)
+
+
+class _Values(dict):
+    # поля, которых нет в строке, подставляются пустыми
+    def __missing__(self, key):
+        return ""
+
+
+def fill_anchor(paragraph, anchor, slot, values):
+    if anchor.fill == "replace":
+        replace_whole_paragraph(paragraph, anchor.template.format_map(values))
+    else:
+        fill_field(paragraph, slot, values.get(anchor.name, ""))
+
+
+def iter_anchor_fills(doc: Document, mode: str):
+    """
+    Обход документа по правилам режима (rules.MODE_RULES): отдаёт (абзац, номер якоря, слот)
+    в том порядке, в котором надо заполнять. Вызывающий заполняет абзац до следующего
+    шага — оставшиеся якоря проверяются уже по новому тексту.
+    """
+    index = PARAGRAPH_INDEXES[mode]
+    anchors = index.anchors
+    done = set()
+
+    for p in iter_all_paragraphs(doc):
+        matched = index.classify(p.text)
+        while matched:
+            i = matched.pop(0)
+            anchor = anchors[i]
+            if anchor.once and i in done:
+                continue
+            slot = None
+            if anchor.fill == "field":
+                slot = locate_field_run(p)
+                if slot is None:
+                    continue
+
+            yield p, i, slot
+            done.add(i)
+            if index.rules.first_anchor_only:
+                break
+            matched = [j for j in index.classify(p.text) if j > i]
+
+
+def apply_rules(doc: Document, mode: str, values: dict):
+    values = _Values(values)
+    anchors = PARAGRAPH_INDEXES[mode].anchors
+    for p, i, slot in iter_anchor_fills(doc, mode):
+        fill_anchor(p, anchors[i], slot, values)
+
+
+# ------------------------
+# Compiled template
+# ------------------------
+class CompiledTemplate:
+    """
+    Шаблон Word, разобранный один раз.
+
+    При создании zip распаковывается и XML парсится единожды, а заодно
+    находятся "слоты": какие абзацы и run-поля заполняют якоря режима
+    (rules.MODE_RULES). Для каждой строки Excel берётся
+    копия XML в памяти, слоты заполняются, и документ сериализуется в bytes.
+
+    Меняется только word/document.xml, поэтому остальные части архива (стили,
+    темы, шрифты, картинки) сжимаются один раз в "базовый" zip, а для каждой
+    строки к его копии дописывается лишь новый document.xml.
+    """
+
+    # нейтральное значение для прогона логики при компиляции
+    _PROBE = "0"
+
+    def __init__(self, template_bytes: bytes, mode: str):
+        self.mode = mode
+        doc = Document(BytesIO(template_bytes))
+        self._part = doc.part
+        self._pristine = deepcopy(doc.element)
+        # если в одном абзаце несколько слотов, итог зависит от значений —
+        # тогда на копии просто выполняется обычная логика замен
+        self._dynamic = False
+        self._slots = []
+
+        self._compile(DocxDocument(deepcopy(self._pristine), self._part))
+
+        filled = [i for i, _, _ in self._slots]
+        if len(filled) != len(set(filled)):
+            self._dynamic = True
+
+        self._document_member = self._part.partname[1:]
+        self._base_zip, self._document_info = self._build_base_zip(template_bytes, self._document_member)
+        # списки из стилей абзацев — для общего документа (merge_body)
+        self._style_numbering = {}
+        for rel in self._part.rels.values():
+            if rel.reltype == RT.STYLES and not rel.is_external:
+                self._style_numbering = style_numbering(rel.target_part.element)
+
+    @staticmethod
+    def _build_base_zip(template_bytes: bytes, document_member: str):
+        base = BytesIO()
+        document_info = None
+        with zipfile.ZipFile(BytesIO(template_bytes)) as src, zipfile.ZipFile(base, "w") as dst:
+            for info in src.infolist():
+                if info.filename == document_member:
+                    document_info = info
+                    continue
+                dst.writestr(info, src.read(info))
+        if document_info is None:
+            raise ValueError(f"В шаблоне нет {document_member}")
+        return base.getvalue(), document_info
+
+    def _compile(self, scratch):
+        index = {el: i for i, el in enumerate(scratch.element.iter(qn("w:p")))}
+        anchors = PARAGRAPH_INDEXES[self.mode].anchors
+        probe = defaultdict(lambda: self._PROBE)
+        for p, a, slot in iter_anchor_fills(scratch, self.mode):
+            entry = (index[p._p], a, slot)
+            # объединённые ячейки отдаются по несколько раз — повторная замена абзаца целиком идемпотентна
+            if not (anchors[a].fill == "replace" and entry in self._slots):
+                self._slots.append(entry)
+            # заполняем черновик, чтобы следующие проверки видели тот же текст, что и при обычной замене
+            fill_anchor(p, anchors[a], slot, probe)
+
+    def render_element(self, values: dict):
+        """Заполненная копия XML документа (w:document)."""
+        element = deepcopy(self._pristine)
+        doc = DocxDocument(element, self._part)
+
+        if self._dynamic:
+            apply_rules(doc, self.mode, values)
+        else:
+            values = _Values(values)
+            anchors = PARAGRAPH_INDEXES[self.mode].anchors
+            paragraphs = list(element.iter(qn("w:p")))
+            for i, a, slot in self._slots:
+                fill_anchor(Paragraph(paragraphs[i], doc._body), anchors[a], slot, values)
+
+        return element
+
+    def pack(self, element) -> bytes:
+        """DOCX (bytes) с данным XML документа."""
+        return self.pack_xml(serialize_part_xml(element))
+
+    def pack_xml(self, document_xml: bytes) -> bytes:
+        # копия базового архива + новый document.xml; остальные части не пережимаются
+        buf = BytesIO(self._base_zip)
+        with zipfile.ZipFile(buf, "a") as zf:
+            zf.writestr(self._document_info, document_xml)
+        return buf.getvalue()
+
+    def merge_parts(self) -> "MergeParts":
+        """Части для сборки общего документа из многих копий шаблона (см. output.MergedDocxOutput)."""
+        head, _, sect_pr, tail, prefix = split_document_xml(serialize_part_xml(self._pristine))
+        # без свойств раздела в шаблоне копии разделяются абзацем с разрывом страницы
+        separator = b"" if sect_pr else b'<%sp><%sr><%sbr %stype="page"/></%sr></%sp>' % ((prefix,) * 7)
+        numbering = None
+        for rel in self._part.rels.values():
+            if rel.reltype == RT.NUMBERING and not rel.is_external:
+                member = rel.target_part.partname[1:]
+                with zipfile.ZipFile(BytesIO(self._base_zip)) as base:
+                    numbering = (base.getinfo(member), base.read(member))
+        return MergeParts(self._base_zip, self._document_info, head, separator, sect_pr, tail, numbering)
+
+    def merge_body(self, element) -> "MergeBody":
+        """
+        Содержимое w:body заполненной копии для общего документа: в w:pPr последнего
+        абзаца отмечено место для w:sectPr — им копия заканчивает свой раздел, если за
+        ней идёт следующая (без лишнего пустого абзаца, который мог бы дать пустую страницу).
+        Абзацы, которые нумеруются через стиль (например, "Нумерованный список"), получают
+        явный w:numPr, чтобы у копии были свои списки (см. offset_num_ids). Меняет element.
+        """
+        body = element.body
+        if self._style_numbering:
+            add_style_num_pr(body, self._style_numbering)
+        final_sect_pr = body.find(qn("w:sectPr"))
+        children = [child for child in body if child is not final_sect_pr]
+        last = children[-1] if children else None
+        if last is None or last.tag != qn("w:p") or last.find(qn("w:pPr") + "/" + qn("w:sectPr")) is not None:
+            # тело кончается таблицей или своим разрывом раздела — нужен отдельный абзац
+            last = OxmlElement("w:p")
+            if final_sect_pr is not None:
+                final_sect_pr.addprevious(last)
+            else:
+                body.append(last)
+        # пустой w:sectPr — метка места; в тексте он единственный такой
+        last.get_or_add_pPr().get_or_add_sectPr()
+        xml = document_body(serialize_part_xml(element))
+        mark = list(_EMPTY_SECT_PR.finditer(xml))[-1]
+        return MergeBody(xml[: mark.start()] + xml[mark.end():], mark.start())
+
+
+# ------------------------
+# Merged output (one document from many copies)
+# ------------------------
+class MergeParts(NamedTuple):
+    # части шаблона кроме document.xml (стили, нумерация, картинки) — общие для всех копий
+    base_zip: bytes
+    document_info: zipfile.ZipInfo
+    # document.xml до содержимого w:body включительно
+    head: bytes
+    # между копиями, если в шаблоне нет свойств раздела (абзац с разрывом страницы)
+    separator: bytes
+    # свойства раздела шаблона: вставляются в последний абзац каждой копии, кроме последней
+    sect_pr: bytes
+    # закрывающие теги w:body и документа (перед ними — sect_pr последнего раздела)
+    tail: bytes
+    # (ZipInfo, bytes) numbering.xml шаблона или None: в общем документе у каждой копии
+    # свои списки, поэтому часть дописывается в конце (numbering_with_restarts)
+    numbering: Optional[tuple] = None
+
+
+class MergeBody(NamedTuple):
+    """Содержимое w:body одной копии для общего документа (CompiledTemplate.merge_body)."""
+
+    xml: bytes
+    # позиция в xml внутри w:pPr последнего абзаца, куда вставляется w:sectPr
+    sect_at: int
+
+
+_BODY_OPEN = re.compile(rb"<(\w+:)?body\b[^>]*?(/?)>")
+
+
+def split_document_xml(document_xml: bytes):
+    """
+    document.xml -> (начало до <w:body> включительно, содержимое body без итогового
+    w:sectPr, итоговый w:sectPr, закрывающие теги, префикс "w:").
+    """
+    m = _BODY_OPEN.search(document_xml)
+    if m is None:
+        raise ValueError("В document.xml нет w:body")
+    prefix = m.group(1) or b""
+    if m.group(2):
+        # пустой <w:body/>
+        return document_xml[: m.start()] + b"<%sbody>" % prefix, b"", b"", b"</%sbody>" % prefix + document_xml[m.end():], prefix
+    body_close = document_xml.rindex(b"</%sbody>" % prefix)
+    head, body, tail = document_xml[: m.end()], document_xml[m.end(): body_close], document_xml[body_close:]
+
+    # w:sectPr самого body — всегда последний дочерний элемент
+    sect_pr = b""
+    start = body.rfind(b"<%ssectPr" % prefix)
+    if start != -1 and body.rstrip().endswith(b"</%ssectPr>" % prefix) and body.count(b"<%ssectPr" % prefix, start + 1) == 0:
+        sect_pr, body = body[start:].rstrip(), body[:start]
+    return head, body, sect_pr, tail, prefix
+
+
+def document_body(document_xml: bytes) -> bytes:
+    return split_document_xml(document_xml)[1]
+
+
+_EMPTY_SECT_PR = re.compile(rb"<(?:\w+:)?sectPr/>")
+
+# ссылки абзацев на списки (w:num); 0 — "без нумерации"
+_NUM_IDS = re.compile(rb'(<w:numId\b[^>]*?\bw:val=")(\d+)"')
+
+
+def style_numbering(styles) -> dict:
+    """
+    {styleId: (numId, ilvl)} стилей абзацев из styles.xml, которые нумеруют абзацы
+    (w:numPr в стиле или в стиле, на котором он основан). Ключ None — стиль по умолчанию.
+    """
+    own, based_on, default = {}, {}, None
+    for style in styles.iterchildren(qn("w:style")):
+        if style.get(qn("w:type")) != "paragraph":
+            continue
+        style_id = style.get(qn("w:styleId"))
+        if style.get(qn("w:default")) in ("1", "true", "on"):
+            default = style_id
+        parent = style.find(qn("w:basedOn"))
+        if parent is not None:
+            based_on[style_id] = parent.get(qn("w:val"))
+        num_pr = style.find(qn("w:pPr") + "/" + qn("w:numPr"))
+        if num_pr is not None:
+            num_id, ilvl = num_pr.find(qn("w:numId")), num_pr.find(qn("w:ilvl"))
+            own[style_id] = (
+                num_id.get(qn("w:val")) if num_id is not None else None,
+                ilvl.get(qn("w:val")) if ilvl is not None else None,
+            )
+
+    resolved = {}
+    for style_id in set(own) | set(based_on):
+        num_id = ilvl = None
+        seen, current = set(), style_id
+        # ближайший стиль по цепочке basedOn, где задан numId (и отдельно ilvl)
+        while current is not None and current not in seen and (num_id is None or ilvl is None):
+            seen.add(current)
+            own_num_id, own_ilvl = own.get(current, (None, None))
+            num_id = num_id if num_id is not None else own_num_id
+            ilvl = ilvl if ilvl is not None else own_ilvl
+            current = based_on.get(current)
+        if num_id not in (None, "0"):
+            resolved[style_id] = (num_id, ilvl or "0")
+    if default in resolved:
+        resolved[None] = resolved[default]
+    return resolved
+
+
+def add_style_num_pr(body, numbering: dict):
+    """Абзацам со списком из стиля (numbering — style_numbering()) дописывает явный w:numPr."""
+    for p in body.iter(qn("w:p")):
+        p_pr = p.find(qn("w:pPr"))
+        p_style = p_pr.find(qn("w:pStyle")) if p_pr is not None else None
+        found = numbering.get(p_style.get(qn("w:val")) if p_style is not None else None)
+        if found is None:
+            continue
+        num_id, ilvl = found
+        num_pr = p_pr.find(qn("w:numPr")) if p_pr is not None else None
+        if num_pr is not None and num_pr.find(qn("w:numId")) is not None:
+            continue
+        if p_pr is None:
+            p_pr = p.get_or_add_pPr()
+        num_pr = p_pr.get_or_add_numPr()
+        if num_pr.find(qn("w:ilvl")) is None:
+            num_pr.get_or_add_ilvl().val = int(ilvl)
+        num_pr.get_or_add_numId().val = int(num_id)
+
+
+def used_num_ids(body: bytes) -> set:
+    return {int(m.group(2)) for m in _NUM_IDS.finditer(body)} - {0}
+
+
+def max_num_id(numbering_xml: bytes) -> int:
+    numbering = parse_xml(numbering_xml)
+    return max((int(num.get(qn("w:numId"))) for num in numbering.iterchildren(qn("w:num"))), default=0)
+
+
+def offset_num_ids(body: bytes, offset: int) -> bytes:
+    """Переводит списки копии шаблона на её собственные w:num (numId + offset)."""
+    if not offset:
+        return body
+    return _NUM_IDS.sub(lambda m: m.group(0) if m.group(2) == b"0" else m.group(1) + str(int(m.group(2)) + offset).encode() + b'"', body)
+
+
+def numbering_with_restarts(numbering_xml: bytes, num_ids, offsets) -> bytes:
+    """
+    numbering.xml + для каждого offset копии w:num из num_ids с номером numId + offset,
+    у которых все уровни начинаются заново (w:lvlOverride/w:startOverride) —
+    иначе нумерованные списки продолжают счёт от копии к копии.
+    """
+    numbering = parse_xml(numbering_xml)
+    starts = {}
+    for abstract in numbering.iterchildren(qn("w:abstractNum")):
+        levels = {}
+        for lvl in abstract.iterchildren(qn("w:lvl")):
+            start = lvl.find(qn("w:start"))
+            levels[lvl.get(qn("w:ilvl"))] = start.get(qn("w:val")) if start is not None else "0"
+        # список, связанный со стилем (w:numStyleLink), уровней не описывает
+        starts[abstract.get(qn("w:abstractNumId"))] = levels or {str(i): "1" for i in range(9)}
+
+    nums = {num.get(qn("w:numId")): num for num in numbering.iterchildren(qn("w:num"))}
+    templates = []
+    for num_id in sorted(num_ids):
+        num = nums.get(str(num_id))
+        if num is None:
+            continue
+        restarted = deepcopy(num)
+        abstract_id = restarted.find(qn("w:abstractNumId")).get(qn("w:val"))
+        overrides = {o.get(qn("w:ilvl")): o for o in restarted.iterchildren(qn("w:lvlOverride"))}
+        for ilvl, start in starts.get(abstract_id, {}).items():
+            override = overrides.get(ilvl)
+            if override is None:
+                override = OxmlElement("w:lvlOverride")
+                override.set(qn("w:ilvl"), ilvl)
+                restarted.append(override)
+            if override.find(qn("w:startOverride")) is None:
+                start_override = OxmlElement("w:startOverride")
+                start_override.set(qn("w:val"), start)
+                override.insert(0, start_override)
+        templates.append((num_id, restarted))
+
+    # w:num идут после всех w:abstractNum и перед w:numIdMacAtCleanup
+    anchor = list(numbering.iterchildren(qn("w:num")))[-1] if nums else None
+    for offset in offsets:
+        for num_id, restarted in templates:
+            num = deepcopy(restarted)
+            num.set(qn("w:numId"), str(num_id + offset))
+            if anchor is not None:
+                anchor.addnext(num)
+            else:
+                numbering.append(num)
+            anchor = num
+    return serialize_part_xml(numbering)
+
+
+# id картинок (wp:docPr) и закладок должны быть уникальны в пределах документа
+_UNIQUE_IDS = re.compile(rb'(<(?:wp:docPr|w:bookmarkStart|w:bookmarkEnd)\b[^>]*?\bw?:?id=")(\d+)"')
+
+
+def max_unique_id(body: bytes) -> int:
+    return max((int(m.group(2)) for m in _UNIQUE_IDS.finditer(body)), default=-1)
+
+
+def offset_unique_ids(body: bytes, offset: int) -> bytes:
+    """Сдвигает id картинок и закладок копии шаблона, чтобы они не совпадали с другими копиями."""
+    if not offset:
+        return body
+    return _UNIQUE_IDS.sub(lambda m: m.group(1) + str(int(m.group(2)) + offset).encode() + b'"', body)
+
+
+# ------------------------
+# Generation (serial / process pool)
+# ------------------------
+def process_pool_allowed() -> bool:
+    # в собранном PyInstaller-EXE дочерний процесс запускает не рендер, а ещё одну копию
+    # приложения, поэтому там генерация идёт только в одном процессе
+    return not getattr(sys, "frozen", False)
+
+
+def default_workers() -> int:
+    if not process_pool_allowed():
+        return 1
+    return os.cpu_count() or 1
+
+
+def record_filename(record: RowRecord) -> str:
+    return make_safe_filename(record.fio) + ".docx"
+
+
+def record_values(record: RowRecord, custom_jobplace: str) -> dict:
+    values = record._asdict()
+    values["jobplace"] = custom_jobplace
+    return values
+
+
+class Rendered(NamedTuple):
+    filename: str
+    # DOCX целиком (None, если он никому не нужен)
+    data: Optional[bytes]
+    row: int
+    # время заполнения и упаковки документа (в процессе, где он рендерился)
+    seconds: float
+    # содержимое w:body — для общего документа (если запрошено)
+    body: Optional[MergeBody] = None
+
+
+class _RowRenderer:
+    """Шаблоны + место работы: всё, что нужно, чтобы из RowRecord получить DOCX."""
+
+    def __init__(self, templates, custom_jobplace: str, pack: bool = True, body: bool = False):
+        # templates: [(bytes шаблона, режим, CompiledTemplate | None), ...]
+        self.compiled = [compiled or CompiledTemplate(template_bytes, mode) for template_bytes, mode, compiled in templates]
+        self.custom_jobplace = custom_jobplace
+        self.pack = pack
+        self.body = body
+
+    def render(self, compiled: CompiledTemplate, record: RowRecord) -> Rendered:
+        started = time.perf_counter()
+        element = compiled.render_element(record_values(record, self.custom_jobplace))
+        data = compiled.pack(element) if self.pack else None
+        body = compiled.merge_body(element) if self.body else None
+        return Rendered(record_filename(record), data, record.row, time.perf_counter() - started, body)
+
+    def render_chunk(self, chunk):
+        # элемент порции — None (строка пропущена) или кортеж записей по шаблонам,
+        # где None — документ по этому шаблону не нужен
+        results = []
+        for item in chunk:
+            if item is None:
+                results.append(None)
+                continue
+            results.append(tuple(None if record is None else self.render(compiled, record) for compiled, record in zip(self.compiled, item)))
+        return results
+
+
+# шаблоны передаются в процесс один раз (initializer), а не с каждой порцией строк
+_worker_renderer = None
+
+
+def _init_worker(templates, custom_jobplace: str, pack: bool, body: bool):
+    global _worker_renderer
+    _worker_renderer = _RowRenderer([(template_bytes, mode, None) for template_bytes, mode in templates], custom_jobplace, pack, body)
+
+
+def _render_chunk_in_worker(chunk):
+    return _worker_renderer.render_chunk(chunk)
+
+
+# общий пул (режим сервера): процессы не привязаны к заданию, поэтому с порцией
+# приходит только ключ задания и путь к файлу с шаблонами — процесс читает его
+# один раз и хранит разобранные шаблоны по ключу
+_shared_renderers = OrderedDict()
+_SHARED_RENDERERS_MAX = 8
+
+
+def renderer_key(templates, custom_jobplace: str, pack: bool, body: bool) -> str:
+    digest = hashlib.sha256()
+    for template_bytes, mode in templates:
+        digest.update(hashlib.sha256(template_bytes).digest())
+        digest.update(mode.encode("utf-8"))
+    digest.update(f"{custom_jobplace}\0{pack}\0{body}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _render_chunk_shared(key: str, renderer_path: str, chunk):
+    renderer = _shared_renderers.get(key)
+    if renderer is None:
+        with open(renderer_path, "rb") as f:
+            templates, custom_jobplace, pack, body = pickle.load(f)
+        renderer = _RowRenderer([(template_bytes, mode, None) for template_bytes, mode in templates], custom_jobplace, pack, body)
+        _shared_renderers[key] = renderer
+        while len(_shared_renderers) > _SHARED_RENDERERS_MAX:
+            _shared_renderers.popitem(last=False)
+    else:
+        _shared_renderers.move_to_end(key)
+    return renderer.render_chunk(chunk)
+
+
+def _chunked(rows, chunk_size: int):
+    chunk = []
+    for item in rows:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _generate_serial(rows, renderer: _RowRenderer, chunk_size: int):
+    for chunk in _chunked(rows, chunk_size):
+        yield from renderer.render_chunk(chunk)
+
+
+def _worker_ready():
+    return True
+
+
+def start_worker_pool(templates, custom_jobplace: str, workers: int, pack: bool = True, body: bool = False):
+    """Пул процессов, в каждом из которых уже разобраны шаблоны [(bytes шаблона, режим), ...]."""
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(list(templates), custom_jobplace, pack, body),
+    )
+    try:
+        pool.submit(_worker_ready).result()
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    return pool
+
+
+def _generate_parallel(rows, submit, window: int, chunk_size: int):
+    # держим в работе ограниченное окно порций: память не растёт с размером файла,
+    # а результаты отдаются строго по порядку строк
+    chunks = _chunked(rows, chunk_size)
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < window:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                pending.append(submit(chunk))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+    finally:
+        # генерацию прервали — ещё не начатые порции не нужны
+        for future in pending:
+            future.cancel()
+
+
+def generate_fanout(rows, templates, custom_jobplace: str, workers: int = 1, chunk_size: int = 16, pack: bool = True, body: bool = False, pool=None):
+    """
+    Генерация документов сразу по нескольким шаблонам: строка Excel читается
+    и разбирается один раз, а рендерится по каждому шаблону.
+
+    templates — [(bytes шаблона, режим, CompiledTemplate | None), ...].
+    rows — итератор: None (строка пропущена) или кортеж RowRecord | None по шаблонам.
+    Для каждой входной строки по порядку отдаёт None или кортеж Rendered | None по шаблонам.
+    pack — собирать DOCX (Rendered.data), body — отдавать содержимое w:body (Rendered.body).
+
+    workers > 1 — строки порциями по chunk_size рендерятся в пуле процессов.
+    Если пул не удалось запустить, генерация идёт в текущем процессе
+    (с уже разобранными шаблонами из templates, если они есть).
+
+    pool — общий пул (server.SessionPool: submit(fn, *args) -> Future, window):
+    порции уходят в него, собственный пул не создаётся, workers не учитывается.
+    """
+    templates = list(templates)
+    if pool is not None:
+        shipped = [(template_bytes, mode) for template_bytes, mode, _ in templates]
+        key = renderer_key(shipped, custom_jobplace, pack, body)
+        # шаблоны (бывают по несколько МБ) не повторяются в каждой порции
+        fd, renderer_path = tempfile.mkstemp(prefix="profpak-templates-", suffix=".pkl")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((shipped, custom_jobplace, pack, body), f, protocol=pickle.HIGHEST_PROTOCOL)
+            submit = lambda chunk: pool.submit(_render_chunk_shared, key, renderer_path, chunk)  # noqa: E731
+            yield from _generate_parallel(rows, submit, pool.window, chunk_size)
+        finally:
+            Path(renderer_path).unlink(missing_ok=True)
+        return
+
+    pool = None
+    if workers > 1:
+        try:
+            pool = start_worker_pool([(template_bytes, mode) for template_bytes, mode, _ in templates], custom_jobplace, workers, pack, body)
+        except (BrokenProcessPool, OSError):
+            logger.warning("Process pool is unavailable, falling back to serial generation", exc_info=True)
+
+    if pool is None:
+        yield from _generate_serial(rows, _RowRenderer(templates, custom_jobplace, pack, body), chunk_size)
+        return
+
+    try:
+        yield from _generate_parallel(rows, lambda chunk: pool.submit(_render_chunk_in_worker, chunk), workers * 2, chunk_size)
+    finally:
+        pool.shutdown(cancel_futures=True)
@@ -0,0 +1,170 @@
+from contextlib import contextmanager
+import heapq
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def current_rss_mb():
+    """Текущий объём памяти (RSS / рабочий набор) этого процесса в МБ или None, если узнать нельзя."""
+    if os.name == "nt":
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [
+                    ("cb", wintypes.DWORD),
+                    ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t),
+                    ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t),
+                    ("PeakPagefileUsage", ctypes.c_size_t),
+                ]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize / 1024 / 1024
+        except Exception:
+            return None
+        return None
+
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+class RssPeak:
+    """
+    Пик памяти процесса за один запуск. ru_maxrss и PeakWorkingSetSize — максимум за всю
+    жизнь процесса, в долгоживущем приложении они перестают меняться после первого
+    большого запуска. Поэтому текущий RSS замеряется по ходу работы: sample() вызывается
+    часто, но читает память не чаще раза в interval секунд. Процессы пула рендера не учитываются.
+    """
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.start_mb = current_rss_mb()
+        self.peak_mb = self.start_mb
+        self._last = time.perf_counter()
+
+    def sample(self, force: bool = False):
+        if self.start_mb is None:
+            return
+        now = time.perf_counter()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        rss = current_rss_mb()
+        if rss is not None and rss > self.peak_mb:
+            self.peak_mb = rss
+
+    @property
+    def growth_mb(self):
+        """На сколько пик превысил память на старте."""
+        return self.peak_mb - self.start_mb if self.start_mb is not None else None
+
+
+class RunMetrics:
+    """
+    Замеры одного запуска генерации: время по этапам, самые медленные строки,
+    строк/с и пик памяти основного процесса за этот запуск (RssPeak).
+    summary() — для панели в UI, log() — JSON-строки в лог.
+    """
+
+    def __init__(self, label: str = "", slowest: int = 10):
+        self.label = label
+        self.stages = {}
+        self.calls = {}
+        self.rows = 0
+        self.docs = 0
+        self._slowest_n = slowest
+        self._slowest = []
+        self._started = time.perf_counter()
+        self._finished = None
+        self.memory = RssPeak()
+
+    def add(self, name: str, seconds: float, calls: int = 1):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+        self.memory.sample()
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def timed_iter(self, name: str, iterable):
+        """Итератор, время ожидания каждого элемента которого идёт в этап name."""
+        it = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add(name, time.perf_counter() - started, calls=0)
+                return
+            self.add(name, time.perf_counter() - started)
+            yield item
+
+    def row(self, row: int, filename: str, seconds: float):
+        self.docs += 1
+        item = (seconds, row, filename)
+        if len(self._slowest) < self._slowest_n:
+            heapq.heappush(self._slowest, item)
+        elif item > self._slowest[0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def finish(self):
+        self._finished = time.perf_counter()
+        self.memory.sample(force=True)
+
+    @property
+    def wall_seconds(self) -> float:
+        return (self._finished or time.perf_counter()) - self._started
+
+    def summary(self) -> dict:
+        wall = self.wall_seconds
+        memory = self.memory
+        return {
+            "label": self.label,
+            "wall_seconds": round(wall, 3),
+            "rows": self.rows,
+            "docs": self.docs,
+            "rows_per_second": round(self.rows / wall, 1) if wall else None,
+            # основной процесс, за этот запуск; процессы пула рендера не входят
+            "peak_rss_mb": round(memory.peak_mb, 1) if memory.peak_mb is not None else None,
+            "rss_growth_mb": round(memory.growth_mb, 1) if memory.growth_mb is not None else None,
+            "stages": [
+                {"stage": name, "seconds": round(sec, 3), "calls": self.calls[name], "share": round(sec / wall, 3) if wall else None}
+                for name, sec in sorted(self.stages.items(), key=lambda kv: kv[1], reverse=True)
+            ],
+            "slowest_rows": [
+                {"row": row, "file": filename, "ms": round(sec * 1000, 1)}
+                for sec, row, filename in sorted(self._slowest, reverse=True)
+            ],
+        }
+
+    def log(self):
+        summary = self.summary()
+        for stage in summary["stages"]:
+            logger.info(json.dumps({"event": "stage", "label": self.label, **stage}, ensure_ascii=False))
+        # имена файлов — это ФИО сотрудников, в лог идут только номера строк
+        slowest = [{k: v for k, v in row.items() if k != "file"} for row in summary["slowest_rows"]]
+        logger.info(json.dumps({"event": "run", **summary, "slowest_rows": slowest}, ensure_ascii=False))
+        return summary
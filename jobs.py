@@ -0,0 +1,455 @@
+"""
+Очередь заданий генерации.
+
+Задание выполняется фоновым потоком, а не внутри перезапуска скрипта Streamlit,
+поэтому любое действие в интерфейсе посреди генерации её не прерывает.
+Состояние задания (прогресс, счётчики, ошибка, куда сохранено) хранится в памяти
+процесса и дублируется JSON-файлом в папке заданий: после перезапуска программы
+видно, чем закончились прошлые задания.
+
+Архивы и общие документы «для скачивания через браузер» пишутся не в память,
+а во временную папку рядом с состоянием заданий; они удаляются через download_ttl
+секунд, при превышении max_download_bytes (сначала старые) и при перезапуске.
+
+В режиме сервера (server.py) задания разных пользователей выполняются параллельно
+и рендерят в общем пуле процессов; очередь следит за лимитами на размер задания
+и первым берёт задание того пользователя, у кого сейчас меньше выполняющихся;
+больше max_running_per_session заданий одного пользователя сразу не выполняется,
+поэтому его очередь не занимает все места.
+"""
+from collections import Counter
+from pathlib import Path
+from typing import NamedTuple, Optional
+import json
+import logging
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import cache
+import server
+from instrumentation import RunMetrics
+from output import MergedDocxOutput, ZipOutput, write_file_atomic
+from pipeline import MissingColumnsError, make_targets, require_columns, run_targets
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+# было в работе, когда программу закрыли
+STATUS_INTERRUPTED = "interrupted"
+
+STATUS_LABELS = {
+    STATUS_QUEUED: "⏳ В очереди",
+    STATUS_RUNNING: "⚙️ Выполняется",
+    STATUS_DONE: "✅ Готово",
+    STATUS_FAILED: "❌ Ошибка",
+    STATUS_CANCELLED: "⏹️ Отменено",
+    STATUS_INTERRUPTED: "⚠️ Прервано",
+}
+
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+
+class AdmissionError(ValueError):
+    """Задание не принято или остановлено: превышен лимит режима сервера."""
+
+
+class JobSpec(NamedTuple):
+    """Всё, что нужно для генерации: входные файлы и настройки сохранения."""
+
+    excel_name: str
+    excel_bytes: bytes
+    # ((режим, bytes шаблона), ...): при нескольких режимах документы каждого
+    # пишутся в свою подпапку (и папку внутри ZIP), Excel читается один раз
+    templates: tuple
+    custom_jobplace: str
+    target_dir: Optional[Path] = None
+    fs_writers: int = 4
+    incremental: bool = False
+    remove_stale: bool = False
+    save_zip: bool = False
+    # None при save_zip — архив для скачивания через браузер
+    zip_path: Optional[Path] = None
+    zip_name: str = "documents"
+    zip_compresslevel: int = 6
+    zip_volume_mb: float = 0
+    # один общий DOCX для печати; merged_dir=None — для скачивания через браузер
+    save_merged: bool = False
+    merged_dir: Optional[Path] = None
+    merged_name: str = "documents"
+    workers: int = 1
+    disk_cache: bool = False
+    # время чтения загруженных файлов в интерфейсе — для статистики (этап upload)
+    upload_seconds: float = 0
+
+
+class Job:
+    # поля, которые сохраняются в JSON
+    _PERSISTED = (
+        "id", "label", "mode", "status", "processed", "total", "created", "unchanged", "removed",
+        "error", "target_dir", "zip_volumes", "merged_files", "submitted", "started", "finished", "summary", "session", "user",
+    )
+
+    def __init__(self, spec: Optional[JobSpec], label: str = "", session: str = "", user: str = ""):
+        self.id = uuid.uuid4().hex[:12]
+        self.spec = spec
+        self.label = label
+        # режим сервера: session — сессия браузера (очередь и видимость заданий),
+        # user — введённое имя, только подпись и папка; в обычном режиме оба пустые
+        self.session = session
+        self.user = user
+        self.mode = ", ".join(mode for mode, _ in spec.templates) if spec else ""
+        self.status = STATUS_QUEUED
+        self.processed = 0
+        self.total = 0
+        self.created = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.error = None
+        self.target_dir = str(spec.target_dir) if spec and spec.target_dir is not None else None
+        self.zip_volumes = []
+        self.merged_files = []
+        # (имя, путь) архивов и общих документов для скачивания — во временной папке,
+        # только пока жив процесс и не истёк срок хранения
+        self.downloads = []
+        self.downloads_expired = False
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.summary = None
+        self._cancel = threading.Event()
+
+    @property
+    def active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+    @property
+    def fraction(self) -> float:
+        return min(self.processed / self.total, 1.0) if self.total else 0.0
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def to_dict(self) -> dict:
+        data = {name: getattr(self, name) for name in self._PERSISTED}
+        if data["summary"]:
+            # имена файлов — это ФИО сотрудников, на диск их не пишем
+            data["summary"] = {k: v for k, v in data["summary"].items() if k != "slowest_rows"}
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Job":
+        job = cls(None)
+        for name in cls._PERSISTED:
+            if name in data:
+                setattr(job, name, data[name])
+        return job
+
+
+class JobQueue:
+    """
+    Задания выполняются по очереди фоновыми потоками (workers штук, по умолчанию
+    один: каждое задание и так загружает все ядра пулом процессов).
+    state_dir — папка для JSON-состояния заданий (None — только в памяти).
+
+    Режим сервера: scheduler — общий пул (server.FairScheduler) вместо пула на задание;
+    max_rows (строк с ФИО), max_upload_bytes, max_queued_per_session, max_running_per_session —
+    лимиты (0 — без ограничения).
+    """
+
+    def __init__(
+        self,
+        state_dir=None,
+        workers: int = 1,
+        keep: int = 100,
+        persist_every: float = 1.0,
+        scheduler=None,
+        max_rows: int = 0,
+        max_upload_bytes: int = 0,
+        max_queued_per_session: int = 0,
+        max_running_per_session: int = 0,
+        download_ttl: float = 3600,
+        max_download_bytes: int = 1024 * 1024 * 1024,
+    ):
+        self.state_dir = Path(state_dir) if state_dir is not None else None
+        self.workers = workers
+        self.keep = keep
+        self.persist_every = persist_every
+        self.scheduler = scheduler
+        self.max_rows = max_rows
+        self.max_upload_bytes = max_upload_bytes
+        self.max_queued_per_session = max_queued_per_session
+        self.max_running_per_session = max_running_per_session
+        self.download_ttl = download_ttl
+        self.max_download_bytes = max_download_bytes
+        if self.state_dir is not None:
+            self.downloads_dir = self.state_dir / "downloads"
+            # файлы прошлого запуска уже никто не скачает
+            shutil.rmtree(self.downloads_dir, ignore_errors=True)
+        else:
+            self.downloads_dir = Path(tempfile.mkdtemp(prefix="profpak-downloads-"))
+        self._jobs = {}
+        self._threads = []
+        # RLock: cancel() и _finish() берут его повторно через _prune()
+        self._lock = threading.RLock()
+        # ожидание новых заданий потоками-исполнителями
+        self._ready = threading.Condition(self._lock)
+        self._load_history()
+
+    # ------------------------
+    # API
+    # ------------------------
+    def submit(self, spec: JobSpec, label: str = "", session: str = "", user: str = "") -> Job:
+        """Ставит задание в очередь; AdmissionError — задание превышает лимиты."""
+        size = len(spec.excel_bytes) + sum(len(template_bytes) for _, template_bytes in spec.templates)
+        if self.max_upload_bytes and size > self.max_upload_bytes:
+            raise AdmissionError(
+                f"Загружено {size / 1024 / 1024:.1f} МБ, можно не больше {self.max_upload_bytes / 1024 / 1024:.0f} МБ на задание"
+            )
+        job = Job(spec, label or spec.excel_name, session, user)
+        with self._lock:
+            if self.max_queued_per_session and len([j for j in self.jobs(session) if j.active]) >= self.max_queued_per_session:
+                raise AdmissionError(f"Уже есть {self.max_queued_per_session} незавершённых заданий — дождитесь их окончания")
+            self._jobs[job.id] = job
+            self._start_threads()
+            self._persist(job)
+            self._ready.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is not None and job.downloads and job.finished and time.time() - job.finished > self.download_ttl:
+            self._drop_downloads(job)
+        return job
+
+    def jobs(self, session: Optional[str] = None) -> list:
+        """Все известные задания (или задания пользователя session), новые первыми."""
+        jobs = [job for job in list(self._jobs.values()) if session is None or job.session == session]
+        return sorted(jobs, key=lambda job: job.submitted, reverse=True)
+
+    def status(self) -> dict:
+        """Сколько заданий выполняется и ждёт — всего и по пользователям."""
+        with self._lock:
+            running = Counter(job.session for job in self._jobs.values() if job.status == STATUS_RUNNING)
+            queued = Counter(job.session for job in self._jobs.values() if job.status == STATUS_QUEUED)
+        return {"workers": self.workers, "running": dict(running), "queued": dict(queued)}
+
+    def cancel(self, job_id: str):
+        job = self._jobs.get(job_id)
+        if job is None or not job.active:
+            return
+        job._cancel.set()
+        with self._lock:
+            # ещё не начатое задание снимаем сразу; выполняющееся остановится само
+            if job.status == STATUS_QUEUED:
+                self._finish(job, STATUS_CANCELLED)
+
+    # ------------------------
+    # Worker
+    # ------------------------
+    def _start_threads(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"profpak-job-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _next_job(self) -> Job:
+        # первым — задание пользователя, у которого сейчас меньше всего выполняется,
+        # среди них — самое раннее; с одним пользователем это обычная очередь
+        with self._ready:
+            while True:
+                running = Counter(job.session for job in self._jobs.values() if job.status == STATUS_RUNNING)
+                limit = self.max_running_per_session
+                queued = [
+                    job for job in self._jobs.values()
+                    if job.status == STATUS_QUEUED and not (limit and running[job.session] >= limit)
+                ]
+                if queued:
+                    job = min(queued, key=lambda job: (running[job.session], job.submitted))
+                    job.status = STATUS_RUNNING
+                    job.started = time.time()
+                    return job
+                self._ready.wait()
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            self._persist(job)
+            try:
+                self._run(job)
+            except MissingColumnsError as e:
+                job.error = f"Неверный Excel-шаблон для выбранного режима. {e}"
+                self._finish(job, STATUS_FAILED)
+            except AdmissionError as e:
+                job.error = str(e)
+                self._finish(job, STATUS_FAILED)
+            except Exception as e:
+                logger.exception("Job %s failed", job.id)
+                job.error = f"{type(e).__name__}: {e}"
+                self._finish(job, STATUS_FAILED)
+
+    def _run(self, job: Job):
+        spec = job.spec
+        metrics = RunMetrics(label=job.label)
+        if spec.upload_seconds:
+            metrics.add("upload", spec.upload_seconds)
+        with metrics.stage("template_compile"):
+            compiled = [cache.templates.get(template_bytes, mode) for mode, template_bytes in spec.templates]
+        modes = [mode for mode, _ in spec.templates]
+
+        with cache.workbooks.open(spec.excel_bytes, use_disk=spec.disk_cache, filename=spec.excel_name) as source:
+            # до создания архивов и папок: при неверном Excel ничего не остаётся на диске
+            require_columns(source.cols, *modes)
+            # число строк листа — только для прогресса; лимит считается по строкам с ФИО при чтении
+            job.total = source.total_rows
+            spool = self.downloads_dir / job.id
+            zip_output = None
+            if spec.save_zip:
+                zip_path = spec.zip_path or spool / f"{spec.zip_name}.zip"
+                zip_output = ZipOutput(zip_path, compresslevel=spec.zip_compresslevel, volume_mb=spec.zip_volume_mb)
+            targets = make_targets(
+                [(mode, template_bytes, c) for (mode, template_bytes), c in zip(spec.templates, compiled)],
+                target_dir=spec.target_dir,
+                zip_output=zip_output,
+                fs_writers=spec.fs_writers,
+                incremental=spec.incremental,
+                merged=(spec.merged_dir or spool, spec.merged_name) if spec.save_merged else None,
+            )
+
+            last_persist = [time.monotonic()]
+
+            def on_progress(done, total):
+                job.processed = done
+                if time.monotonic() - last_persist[0] >= self.persist_every:
+                    last_persist[0] = time.monotonic()
+                    self._persist(job)
+
+            try:
+                stats = run_targets(
+                    source,
+                    targets,
+                    spec.custom_jobplace,
+                    workers=spec.workers,
+                    remove_stale=spec.remove_stale,
+                    metrics=metrics,
+                    on_progress=on_progress,
+                    should_stop=job._cancel.is_set,
+                    pool=self.scheduler.for_session(job.session) if self.scheduler is not None else None,
+                    max_records=self.max_rows,
+                )
+            finally:
+                job.summary = metrics.summary()
+
+        job.processed, job.created, job.unchanged, job.removed = stats.processed, stats.created, stats.unchanged, stats.removed
+        if zip_output is not None:
+            if spec.zip_path is None:
+                job.downloads.extend((path.name, path) for path in zip_output.volumes)
+            else:
+                job.zip_volumes = [str(p) for p in zip_output.volumes]
+        for target in targets:
+            for _, out, _ in target.outputs:
+                if isinstance(out, MergedDocxOutput):
+                    if spec.merged_dir is None:
+                        job.downloads.append((out.result.name, out.result))
+                    else:
+                        job.merged_files.append(str(out.result))
+        if stats.over_limit:
+            job.error = (
+                f"В файле больше {self.max_rows} сотрудников (строк с ФИО) — это лимит на одно задание, "
+                "разделите файл на части; созданные документы сохранены"
+            )
+            self._finish(job, STATUS_FAILED)
+            return
+        self._finish(job, STATUS_CANCELLED if stats.cancelled else STATUS_DONE)
+
+    def _finish(self, job: Job, status: str):
+        with self._ready:
+            job.status = status
+            job.finished = time.time()
+            # входные файлы больше не нужны — не держим их в памяти
+            job.spec = None
+            # освободилось место — следующее задание этого пользователя может начаться
+            self._ready.notify_all()
+        if not job.downloads:
+            # упавшее или отменённое задание могло оставить пустую папку
+            shutil.rmtree(self.downloads_dir / job.id, ignore_errors=True)
+        self._persist(job)
+        self._prune()
+
+    # ------------------------
+    # State files
+    # ------------------------
+    def _state_path(self, job_id: str) -> Path:
+        return self.state_dir / f"{job_id}.json"
+
+    def _persist(self, job: Job):
+        if self.state_dir is None:
+            return
+        try:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+            write_file_atomic(self._state_path(job.id), json.dumps(job.to_dict(), ensure_ascii=False).encode("utf-8"))
+        except OSError:
+            logger.warning("Could not save job state %s", job.id, exc_info=True)
+
+    def _load_history(self):
+        if self.state_dir is None or not self.state_dir.is_dir():
+            return
+        for path in self.state_dir.glob("*.json"):
+            try:
+                job = Job.from_dict(json.loads(path.read_text(encoding="utf-8")))
+            except (OSError, ValueError, TypeError):
+                logger.warning("Broken job state file %s, removing", path, exc_info=True)
+                path.unlink(missing_ok=True)
+                continue
+            if job.active:
+                job.status = STATUS_INTERRUPTED
+                self._persist(job)
+            self._jobs[job.id] = job
+
+    def _drop_downloads(self, job: Job):
+        job.downloads = []
+        job.downloads_expired = True
+        shutil.rmtree(self.downloads_dir / job.id, ignore_errors=True)
+
+    def _prune(self):
+        with self._lock:
+            done = [job for job in self.jobs() if not job.active]
+            for job in done[self.keep:]:
+                del self._jobs[job.id]
+                self._drop_downloads(job)
+                if self.state_dir is not None:
+                    self._state_path(job.id).unlink(missing_ok=True)
+            # файлы для скачивания: истёкшие и самые старые сверх лимита (последние — всегда)
+            now = time.time()
+            total = 0
+            for job in done:
+                if not job.downloads:
+                    continue
+                size = sum(Path(path).stat().st_size for _, path in job.downloads if Path(path).exists())
+                if now - job.finished > self.download_ttl or (total and total + size > self.max_download_bytes):
+                    self._drop_downloads(job)
+                else:
+                    total += size
+
+
+# общая для всех сессий и перезапусков скрипта Streamlit
+if server.CONFIG.enabled:
+    job_queue = JobQueue(
+        state_dir=cache.default_cache_dir() / "jobs",
+        workers=server.CONFIG.max_jobs,
+        scheduler=server.scheduler,
+        max_rows=server.CONFIG.max_rows,
+        max_upload_bytes=int(server.CONFIG.max_upload_mb * 1024 * 1024),
+        max_queued_per_session=server.CONFIG.max_queued,
+        max_running_per_session=server.CONFIG.max_running,
+    )
+else:
+    job_queue = JobQueue(state_dir=cache.default_cache_dir() / "jobs")
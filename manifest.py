@@ -0,0 +1,108 @@
+from pathlib import Path
+import hashlib
+import json
+import threading
+
+from engine import record_filename
+from output import write_file_atomic
+
+MANIFEST_NAME = ".profpak_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def template_digest(template_bytes: bytes) -> str:
+    return hashlib.sha256(template_bytes).hexdigest()
+
+
+def row_digest(record, custom_jobplace: str, mode: str, template_hash: str) -> str:
+    # номер строки не входит в хеш: вставка строки выше не должна пересоздавать документы
+    payload = [mode, template_hash, custom_jobplace, list(record[1:])]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class Manifest:
+    """
+    Манифест в папке с документами: имя файла -> хеш (значения строки,
+    место работы, режим, хеш шаблона).
+
+    При повторной генерации строки с тем же хешем и существующим файлом
+    пропускаются. Запись в манифест появляется только после того, как файл
+    действительно записан, и манифест периодически сохраняется — поэтому
+    прерванная генерация продолжается с того места, где остановилась.
+    """
+
+    def __init__(self, target_dir, save_every: int = 50):
+        self.path = Path(target_dir) / MANIFEST_NAME
+        self.target_dir = Path(target_dir)
+        self.save_every = save_every
+        self.entries = self._load()
+        self.unchanged = 0
+        self._seen = set()
+        self._pending = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+            return {}
+        return dict(data.get("files") or {})
+
+    def _is_current(self, filename: str, digest: str) -> bool:
+        return self.entries.get(filename) == digest and (self.target_dir / filename).exists()
+
+    def check(self, record, custom_jobplace: str, mode: str, template_hash: str) -> bool:
+        """True — документ строки нужно создать заново (строка изменилась или файла нет)."""
+        filename = record_filename(record)
+        digest = row_digest(record, custom_jobplace, mode, template_hash)
+        # одно имя у нескольких строк — пересоздаём все, иначе победит не последняя
+        duplicate = filename in self._seen
+        self._seen.add(filename)
+        if not duplicate and self._is_current(filename, digest):
+            self.unchanged += 1
+            return False
+        with self._lock:
+            self._pending[filename] = digest
+        return True
+
+    def filter_changed(self, records, custom_jobplace: str, mode: str, template_hash: str):
+        """Пропускает дальше только изменившиеся строки; остальные заменяются на None."""
+        for record in records:
+            if record is None or not self.check(record, custom_jobplace, mode, template_hash):
+                yield None
+                continue
+            yield record
+
+    def mark_written(self, filename: str):
+        """Колбэк для DirectoryOutput(on_written=...)."""
+        with self._lock:
+            digest = self._pending.pop(filename, None)
+            if digest is None:
+                return
+            self.entries[filename] = digest
+            self._unsaved += 1
+            if self._unsaved >= self.save_every:
+                self._save_locked()
+
+    def remove_stale(self) -> int:
+        """Удаляет документы строк, которых больше нет в Excel (только учтённые в манифесте)."""
+        removed = 0
+        with self._lock:
+            for filename in [name for name in self.entries if name not in self._seen]:
+                (self.target_dir / filename).unlink(missing_ok=True)
+                del self.entries[filename]
+                removed += 1
+            self._unsaved += removed
+        return removed
+
+    def _save_locked(self):
+        data = {"version": MANIFEST_VERSION, "files": self.entries}
+        write_file_atomic(self.path, json.dumps(data, ensure_ascii=False, indent=1).encode("utf-8"))
+        self._unsaved = 0
+
+    def save(self):
+        with self._lock:
+            self._save_locked()
@@ -0,0 +1,311 @@
+from pathlib import Path
+from io import BytesIO
+import os
+import queue
+import threading
+import uuid
+import zipfile
+
+from engine import max_num_id, max_unique_id, numbering_with_restarts, offset_num_ids, offset_unique_ids, used_num_ids
+
+
+# ------------------------
+# Output sinks
+# ------------------------
+def write_file_atomic(path: Path, data: bytes):
+    """Запись через временное имя + переименование: в папке не бывает недописанных .docx."""
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+class DirectoryOutput:
+    """
+    DOCX-файлы пишутся сразу в целевую папку.
+
+    writers > 0 — запись идёт в фоновых потоках, пока основной поток рендерит
+    следующие документы (полезно для сетевых дисков и флешек). Очереди ограничены
+    queue_size документами, поэтому при медленном диске рендер притормаживает, а
+    память не растёт. Один и тот же файл всегда пишет один поток — порядок
+    перезаписи совпадает с порядком строк.
+
+    on_written(filename) вызывается после того, как файл окончательно записан
+    (из потока записи, если writers > 0).
+
+    Каждый output закрывается close() (всё дописать) или, если генерация упала,
+    abort() (остановить фоновую работу и убрать недописанное).
+    """
+
+    _STOP = object()
+
+    def __init__(self, target_dir, writers: int = 0, queue_size: int = 32, on_written=None):
+        self.target_dir = Path(target_dir)
+        self.on_written = on_written
+        self.target_dir.mkdir(parents=True, exist_ok=True)
+        self.count = 0
+        self._error = None
+        self._aborted = False
+        self._queues = []
+        self._threads = []
+        for _ in range(writers):
+            q = queue.Queue(maxsize=max(queue_size // writers, 1))
+            t = threading.Thread(target=self._writer_loop, args=(q,), daemon=True)
+            t.start()
+            self._queues.append(q)
+            self._threads.append(t)
+
+    def _writer_loop(self, q):
+        while True:
+            item = q.get()
+            if item is self._STOP:
+                return
+            if self._error is not None or self._aborted:
+                # после первой ошибки или abort() остаток очереди просто вычерпывается
+                continue
+            try:
+                self._write_now(*item)
+            except BaseException as e:
+                self._error = e
+
+    def _write_now(self, filename: str, data: bytes):
+        write_file_atomic(self.target_dir / filename, data)
+        if self.on_written is not None:
+            self.on_written(filename)
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, filename: str, data: bytes):
+        self._raise_error()
+        if self._queues:
+            self._queues[hash(filename) % len(self._queues)].put((filename, data))
+        else:
+            self._write_now(filename, data)
+        self.count += 1
+
+    def _stop_writers(self):
+        for q in self._queues:
+            q.put(self._STOP)
+        for t in self._threads:
+            t.join()
+        self._queues = []
+        self._threads = []
+
+    def close(self):
+        """Дожидается фоновой записи; ошибка записи пробрасывается здесь."""
+        self._stop_writers()
+        self._raise_error()
+
+    def abort(self):
+        """Останавливает потоки записи, не дописывая очередь; готовые файлы остаются."""
+        self._aborted = True
+        self._stop_writers()
+
+
+class ZipOutput:
+    """
+    Документы потоково дописываются в ZIP-архив — без промежуточных файлов.
+
+    target — путь к .zip на диске или None (архив собирается в памяти, например
+    для st.download_button). compresslevel: 0 — без сжатия (ZIP_STORED), 1–9 — deflate.
+    volume_mb > 0 — архив делится на тома не больше volume_mb МБ:
+    имя.zip -> имя_1.zip, имя_2.zip, ... (каждый том — самостоятельный архив).
+    Тома прошлого запуска с тем же именем, которых в этот раз нет, удаляются при close().
+    """
+
+    # запас на локальный заголовок и запись в центральном каталоге
+    _ENTRY_OVERHEAD = 512
+
+    def __init__(self, target=None, name: str = "documents", compresslevel: int = 6, volume_mb: float = 0):
+        self.target = Path(target) if target is not None else None
+        self.name = self.target.stem if self.target is not None else name
+        if compresslevel <= 0:
+            self._compression, self._compresslevel = zipfile.ZIP_STORED, None
+        else:
+            self._compression, self._compresslevel = zipfile.ZIP_DEFLATED, min(compresslevel, 9)
+        self.volume_size = int(volume_mb * 1024 * 1024) if volume_mb else 0
+        self.count = 0
+        # после close(): пути томов на диске или (имя, bytes) для архива в памяти
+        self.volumes = []
+
+        # (имя тома, путь или BytesIO)
+        self._volumes = []
+        self._zip = None
+        # имена уникальны по всем томам: их распаковывают в одну папку
+        self._names = set()
+        if self.target is not None:
+            self.target.parent.mkdir(parents=True, exist_ok=True)
+        self._open_volume()
+
+    def _volume_name(self, number: int) -> str:
+        return f"{self.name}.zip" if number == 1 else f"{self.name}_{number}.zip"
+
+    def _open_volume(self):
+        number = len(self._volumes) + 1
+        if number == 2:
+            # появился второй том — первый тоже получает номер
+            first_name, first = self._volumes[0]
+            first_name = f"{self.name}_1.zip"
+            if self.target is not None:
+                # replace, а не rename: на Windows rename не перезаписывает том прошлого запуска
+                first = first.replace(first.with_name(first_name))
+            self._volumes[0] = (first_name, first)
+
+        name = self._volume_name(number)
+        dest = self.target.with_name(name) if self.target is not None else BytesIO()
+        self._volumes.append((name, dest))
+        self._zip = zipfile.ZipFile(dest, "w", compression=self._compression, compresslevel=self._compresslevel)
+        self._volume_entries = 0
+
+    def _unique_name(self, filename: str) -> str:
+        if filename not in self._names:
+            return filename
+        stem, suffix = Path(filename).stem, Path(filename).suffix
+        i = 2
+        while f"{stem}_{i}{suffix}" in self._names:
+            i += 1
+        return f"{stem}_{i}{suffix}"
+
+    def write(self, filename: str, data: bytes):
+        if self.volume_size and self._volume_entries:
+            # DOCX уже сжат, поэтому размер записи в архиве ~ len(data)
+            if self._zip.fp.tell() + len(data) + self._ENTRY_OVERHEAD > self.volume_size:
+                self._zip.close()
+                self._open_volume()
+
+        filename = self._unique_name(filename)
+        self._zip.writestr(filename, data)
+        self._names.add(filename)
+        self._volume_entries += 1
+        self.count += 1
+
+    def _remove_stale_volumes(self):
+        number = len(self._volumes) + 1 if len(self._volumes) > 1 else 1
+        while True:
+            stale = self.target.with_name(f"{self.name}_{number}.zip")
+            if not stale.exists():
+                return
+            stale.unlink()
+            number += 1
+
+    def close(self):
+        self._zip.close()
+        if self.target is not None:
+            self._remove_stale_volumes()
+            self.volumes = [dest for _, dest in self._volumes]
+        else:
+            self.volumes = [(name, dest.getvalue()) for name, dest in self._volumes]
+
+    def abort(self):
+        """Закрывает архив и удаляет недописанные тома с диска."""
+        try:
+            self._zip.close()
+        except (OSError, ValueError):
+            pass
+        if self.target is not None:
+            for _, dest in self._volumes:
+                dest.unlink(missing_ok=True)
+        self._volumes = []
+        self.volumes = []
+
+
+class MergedDocxOutput:
+    """
+    Один общий DOCX для печати: содержимое всех копий шаблона подряд,
+    каждая копия — с новой страницы (последний абзац копии заканчивает раздел со
+    свойствами страницы шаблона).
+
+    Стили, темы и картинки шаблона записываются один раз и общие для всех копий;
+    у каждой копии свои нумерованные списки, которые начинаются заново (numbering.xml
+    дописывается при close()). document.xml пишется в архив потоком, по мере
+    поступления копий (одна копия придерживается: разрыв раздела ставится в неё, только
+    если за ней есть следующая), поэтому память не растёт с числом строк.
+
+    parts — engine.CompiledTemplate.merge_parts(); write() принимает engine.MergeBody
+    копии (Rendered.body), а не готовый DOCX. target — путь к .docx или None (в памяти).
+    """
+
+    # pipeline передаёт сюда Rendered.body вместо DOCX
+    wants_body = True
+
+    def __init__(self, parts, target=None, name: str = "documents", compresslevel: int = 6):
+        self.target = Path(target) if target is not None else None
+        self.name = self.target.name if self.target is not None else f"{name}.docx"
+        self.count = 0
+        # после close(): путь на диске или (имя, bytes) для документа в памяти
+        self.result = None
+        self._parts = parts
+        # шаг, на который сдвигаются id картинок/закладок каждой следующей копии
+        self._id_stride = None
+        # шаг номеров w:num копий и номера списков, на которые ссылаются копии
+        self._num_stride = max_num_id(parts.numbering[1]) + 1 if parts.numbering else 0
+        self._num_ids = set()
+        # (до места w:sectPr, после) последней копии — ещё не записана
+        self._pending = None
+
+        if self.target is not None:
+            self.target.parent.mkdir(parents=True, exist_ok=True)
+        self._dest = self.target if self.target is not None else BytesIO()
+        self._zip = zipfile.ZipFile(self._dest, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+        numbering_member = parts.numbering[0].filename if parts.numbering else None
+        with zipfile.ZipFile(BytesIO(parts.base_zip)) as base:
+            for info in base.infolist():
+                if info.filename != numbering_member:
+                    self._zip.writestr(info, base.read(info))
+        info = zipfile.ZipInfo(parts.document_info.filename, date_time=parts.document_info.date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        self._document = self._zip.open(info, "w", force_zip64=True)
+        self._document.write(parts.head)
+
+    def write(self, filename: str, body):
+        if self._id_stride is None:
+            self._id_stride = max_unique_id(body.xml) + 1
+        if self._num_stride:
+            self._num_ids |= used_num_ids(body.xml)
+        self._flush(ends_section=True)
+        offset, num_offset = self.count * self._id_stride, self.count * self._num_stride
+        self._pending = tuple(
+            offset_num_ids(offset_unique_ids(part, offset), num_offset)
+            for part in (body.xml[: body.sect_at], body.xml[body.sect_at:])
+        )
+        self.count += 1
+
+    def _flush(self, ends_section: bool):
+        if self._pending is None:
+            return
+        before, after = self._pending
+        self._pending = None
+        if ends_section and self._parts.sect_pr:
+            self._document.write(before + self._parts.sect_pr + after)
+        else:
+            self._document.write(before + after)
+            if ends_section:
+                self._document.write(self._parts.separator)
+
+    def close(self):
+        # последняя копия заканчивается итоговым w:sectPr документа
+        self._flush(ends_section=False)
+        self._document.write(self._parts.sect_pr + self._parts.tail)
+        self._document.close()
+        if self._parts.numbering:
+            info, numbering_xml = self._parts.numbering
+            offsets = [n * self._num_stride for n in range(1, self.count)]
+            self._zip.writestr(info, numbering_with_restarts(numbering_xml, self._num_ids, offsets))
+        self._zip.close()
+        self.result = self.target if self.target is not None else (self.name, self._dest.getvalue())
+
+    def abort(self):
+        """Закрывает архив и удаляет недописанный документ с диска."""
+        try:
+            self._document.close()
+            self._zip.close()
+        except (OSError, ValueError, zipfile.BadZipFile):
+            pass
+        if self.target is not None:
+            self.target.unlink(missing_ok=True)
+        self.result = None
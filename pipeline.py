@@ -0,0 +1,215 @@
+"""
+Цикл генерации без UI: общий для Streamlit-приложения, командной строки и очереди заданий.
+
+Источник строк (ExcelSource, CsvSource или лист из кеша) и ZIP-архив создаёт вызывающий код;
+make_targets раскладывает шаблоны по папкам/ZIP, run_targets проходит по строкам.
+"""
+from pathlib import Path
+from typing import NamedTuple
+
+from engine import CompiledTemplate, generate_fanout, make_safe_filename, project_record, validate_columns
+from instrumentation import RunMetrics
+from manifest import Manifest, template_digest
+from output import DirectoryOutput, MergedDocxOutput
+
+
+class MissingColumnsError(ValueError):
+    """В Excel нет колонок, обязательных для выбранного режима."""
+
+    def __init__(self, missing):
+        super().__init__("Не найдены колонки: " + ", ".join(missing))
+        self.missing = missing
+
+
+def require_columns(cols: dict, *modes: str):
+    missing = []
+    for mode in modes:
+        missing.extend(key for key in validate_columns(cols, mode) if key not in missing)
+    if missing:
+        raise MissingColumnsError(missing)
+
+
+def mode_folder(mode: str) -> str:
+    """Подпапка (и папка внутри ZIP) для документов режима, когда режимов несколько."""
+    return make_safe_filename(mode)
+
+
+class Target(NamedTuple):
+    """Один шаблон в задании и куда писать его документы."""
+
+    mode: str
+    template_bytes: bytes
+    # [(имя этапа для статистики, DirectoryOutput | ZipOutput, префикс имени файла)];
+    # один ZipOutput может быть общим для нескольких шаблонов (с разными префиксами)
+    outputs: tuple = ()
+    compiled: object = None
+    # Manifest для инкрементальной генерации (только изменившиеся строки)
+    manifest: object = None
+
+
+def make_targets(templates, target_dir=None, zip_output=None, fs_writers: int = 4, incremental: bool = False, merged=None) -> list:
+    """
+    templates — [(режим, bytes шаблона, CompiledTemplate | None), ...].
+    target_dir — папка для DOCX (None — не сохранять), zip_output — общий ZipOutput или None.
+    При нескольких шаблонах документы каждого режима идут в подпапку mode_folder(режим)
+    (и в такую же папку внутри ZIP); incremental — манифест в каждой папке.
+    merged — (папка или None для документа в памяти, имя без .docx): общий DOCX для печати,
+    по одному на шаблон (при нескольких — имя_<режим>.docx).
+    Если создать outputs не удалось, уже созданные (и zip_output) прерываются.
+    """
+    targets = []
+    outputs = []
+    try:
+        for mode, template_bytes, compiled in templates:
+            folder = mode_folder(mode) if len(templates) > 1 else ""
+            outputs = []
+            manifest = None
+            if target_dir is not None:
+                mode_dir = Path(target_dir) / folder if folder else Path(target_dir)
+                manifest = Manifest(mode_dir) if incremental else None
+                on_written = manifest.mark_written if manifest else None
+                outputs.append(("write_fs", DirectoryOutput(mode_dir, writers=fs_writers, on_written=on_written), ""))
+            if zip_output is not None:
+                outputs.append(("write_zip", zip_output, folder + "/" if folder else ""))
+            if merged is not None:
+                merged_dir, merged_name = merged
+                name = f"{merged_name}_{folder}" if folder else merged_name
+                compiled = compiled or CompiledTemplate(template_bytes, mode)
+                merged_path = Path(merged_dir) / f"{name}.docx" if merged_dir is not None else None
+                outputs.append(("write_merged", MergedDocxOutput(compiled.merge_parts(), merged_path, name=name), ""))
+            targets.append(Target(mode, template_bytes, tuple(outputs), compiled, manifest))
+    except BaseException:
+        # не оставляем потоков записи и пустых архивов от уже созданных outputs (и zip_output)
+        created = {id(out): out for target in targets for _, out, _ in target.outputs}
+        created.update((id(out), out) for _, out, _ in outputs)
+        for out in created.values():
+            out.abort()
+        raise
+    return targets
+
+
+class RunStats(NamedTuple):
+    processed: int
+    created: int
+    unchanged: int
+    removed: int
+    # остановлено через should_stop: записанное сохранено, но не все строки обработаны
+    cancelled: bool = False
+    # остановлено на max_records: строк с ФИО больше лимита (записанное тоже сохранено)
+    over_limit: bool = False
+
+
+def run_targets(
+    source,
+    targets,
+    custom_jobplace: str,
+    workers: int = 1,
+    remove_stale: bool = False,
+    metrics=None,
+    on_progress=None,
+    should_stop=None,
+    pool=None,
+    max_records: int = 0,
+) -> RunStats:
+    """
+    Генерирует документы по всем строкам source для каждого шаблона из targets.
+    Строки читаются и разбираются один раз на все шаблоны.
+
+    Все outputs закрываются здесь (общие — один раз); если генерация или запись упала,
+    незакрытые outputs прерываются (abort) — потоки записи останавливаются,
+    недописанные архивы и общие документы удаляются.
+    on_progress(обработано строк, всего строк) вызывается после каждой строки.
+    should_stop() -> True прерывает генерацию; уже созданные документы дописываются.
+    pool — общий пул режима сервера (server.SessionPool) вместо своего пула на workers процессов.
+    max_records > 0 — не больше стольких строк с ФИО: на следующей чтение останавливается
+    (RunStats.over_limit). total_rows источника — число строк листа, лимитом оно не служит.
+    """
+    targets = list(targets)
+    require_columns(source.cols, *(target.mode for target in targets))
+    metrics = metrics if metrics is not None else RunMetrics(label=", ".join(target.mode for target in targets))
+    for name, seconds in source.timings.items():
+        metrics.add(name, seconds)
+
+    # для одного шаблона читаем только нужные ему колонки
+    single = len(targets) == 1
+    records = metrics.timed_iter("read_rows", source.records(targets[0].mode if single else None))
+    hashes = [template_digest(target.template_bytes) if target.manifest is not None else None for target in targets]
+
+    over_limit = False
+
+    def rows():
+        nonlocal over_limit
+        found = 0
+        for record in records:
+            if record is None:
+                yield None
+                continue
+            found += 1
+            if max_records and found > max_records:
+                over_limit = True
+                return
+            item = []
+            for target, template_hash in zip(targets, hashes):
+                projected = record if single else project_record(record, target.mode)
+                if target.manifest is not None and not target.manifest.check(projected, custom_jobplace, target.mode, template_hash):
+                    projected = None
+                item.append(projected)
+            yield tuple(item) if any(r is not None for r in item) else None
+
+    outputs = list({id(out): (stage, out) for target in targets for stage, out, _ in target.outputs}.values())
+    manifests = [target.manifest for target in targets if target.manifest is not None]
+    total_rows = max(source.total_rows, 1)
+    processed = created = removed = 0
+    cancelled = False
+    results = None
+    closed = set()
+    try:
+        # generate — ожидание очередного документа: чтение строк и рендер
+        # (в пуле процессов — только ожидание результата)
+        templates = [(target.template_bytes, target.mode, target.compiled) for target in targets]
+        # общему документу нужен только w:body, остальным — DOCX целиком
+        bodies = any(getattr(out, "wants_body", False) for _, out in outputs)
+        packed = any(not getattr(out, "wants_body", False) for _, out in outputs)
+        results = generate_fanout(rows(), templates, custom_jobplace, workers=workers, pack=packed, body=bodies, pool=pool)
+        for result in metrics.timed_iter("generate", results):
+            if should_stop is not None and should_stop():
+                cancelled = True
+                break
+            processed += 1
+            metrics.rows = processed
+            if result is not None:
+                for target, doc in zip(targets, result):
+                    if doc is None:
+                        continue
+                    metrics.add("render", doc.seconds)
+                    metrics.row(doc.row, doc.filename if single else f"{mode_folder(target.mode)}/{doc.filename}", doc.seconds)
+                    for stage, out, prefix in target.outputs:
+                        with metrics.stage(stage):
+                            out.write(prefix + doc.filename, doc.body if getattr(out, "wants_body", False) else doc.data)
+                    created += 1
+            if on_progress is not None:
+                on_progress(processed, total_rows)
+        # останавливает пул процессов сразу, а не при сборке мусора
+        results.close()
+
+        for stage, out in outputs:
+            with metrics.stage(stage + "_flush"):
+                out.close()
+            closed.add(id(out))
+
+        if remove_stale and not cancelled and not over_limit:
+            removed = sum(manifest.remove_stale() for manifest in manifests)
+    finally:
+        if results is not None:
+            results.close()
+        for _, out in outputs:
+            if id(out) not in closed:
+                out.abort()
+        # даже при сбое сохраняем, что уже записано, — повторный запуск продолжит с этого места
+        for manifest in manifests:
+            manifest.save()
+        metrics.finish()
+        metrics.log()
+
+    return RunStats(processed, created, sum(manifest.unchanged for manifest in manifests), removed, cancelled, over_limit)
+
@@ -0,0 +1,200 @@
+from typing import NamedTuple
+import re
+
+MODE_CONCLUSION = "Заключение предварительное"
+MODE_DIASKIN = "Направление на диаскин"
+
+
+# ------------------------
+# Rule tables
+# ------------------------
+class Exact(NamedTuple):
+    """Ячейка целиком равна value, если убрать точки и пробелы ("Д. р." -> "др")."""
+
+    value: str
+
+
+class HeaderRule(NamedTuple):
+    key: str
+    # альтернативы: кортеж подстрок (нужны все) или Exact
+    alternatives: tuple
+    # найденная колонка задаёт строку шапки
+    sets_header: bool = False
+
+
+class Anchor(NamedTuple):
+    """Строка шаблона, в которую подставляется значение."""
+
+    name: str
+    # "prefix" — абзац (без краевых пробелов) начинается с patterns[0];
+    # "tokens" — в абзаце (в нижнем регистре) есть все подстроки одной из альтернатив
+    match: str
+    patterns: tuple
+    # "replace" — абзац целиком заменяется на template.format(**values);
+    # "field" — значение пишется в подчёркнутое run-поле (fallback: после двоеточия)
+    fill: str
+    template: str = ""
+    # только первый подходящий абзац в документе
+    once: bool = False
+    # для "tokens": сравнивать текст без пробелов
+    squeeze: bool = False
+
+
+class ModeRules(NamedTuple):
+    required: tuple
+    anchors: tuple
+    # абзацы с этими словами не заполняются "field"-якорями (подписи, печати)
+    exclude: tuple = ()
+    # после первой замены абзац дальше не проверяется
+    first_anchor_only: bool = False
+
+
+HEADER_RULES = (
+    HeaderRule("fio", (("фио",),), sets_header=True),
+    HeaderRule("dob", (("дата", "рожд"), ("д.р",), ("д р",), Exact("др")), sets_header=True),
+    HeaderRule("address", (("адрес",),), sets_header=True),
+    HeaderRule("position", (("штатная должность",), ("должность", "штат"))),
+    HeaderRule("risk", (("факторы риска",), ("фактор", "риска"))),
+    HeaderRule("diagnosis", (("мкб-10",), ("мкб 10",), ("мкб10",))),
+)
+
+MODE_RULES = {
+    MODE_CONCLUSION: ModeRules(
+        required=("fio", "dob", "position", "risk", "diagnosis", "header"),
+        anchors=(
+            Anchor("fio", "prefix", ("1. Ф.И.О",), "replace", "1. Ф.И.О: {fio} {birthdate} г.р."),
+            Anchor("jobplace", "prefix", ("2. Место работы",), "replace", "2. Место работы: {jobplace}"),
+            Anchor(
+                "position",
+                "prefix",
+                ("3. Профессия (должность) (в настоящее время)",),
+                "replace",
+                "3. Профессия (должность) (в настоящее время): {position}",
+            ),
+            Anchor(
+                "risk",
+                "prefix",
+                ("Вредный производственный фактор",),
+                "replace",
+                "Вредный производственный фактор, наименование вида работ: {risk}",
+            ),
+            Anchor("diagnosis", "prefix", ("6. Наименование",), "replace", "6. Наименование: {diagnosis}"),
+        ),
+        first_anchor_only=True,
+    ),
+    MODE_DIASKIN: ModeRules(
+        required=("fio", "dob", "address", "header"),
+        anchors=(
+            Anchor("fio", "tokens", (("ф.и.о.:",), ("фио:",)), "field", once=True, squeeze=True),
+            Anchor("birthdate", "tokens", (("дата", "рожд"),), "field", once=True),
+            Anchor("address", "tokens", (("адрес", "постоянного", "житель"),), "field", once=True),
+        ),
+        exclude=("подпись", "печать", "направившего"),
+    ),
+}
+
+MODES = list(MODE_RULES)
+
+
+# ------------------------
+# Compiled indexes
+# ------------------------
+def _alternation(words) -> str:
+    # длинные первыми, чтобы "мкб-10" не терялся за более коротким совпадением
+    return "|".join(re.escape(w) for w in sorted(set(words), key=len, reverse=True))
+
+
+class TokenIndex:
+    """
+    Набор правил "все подстроки одной из альтернатив" + Exact, собранный в один regex.
+
+    Большинство ячеек/абзацев не содержат ни одного ключевого слова и отсеиваются
+    одним search(); подстроки проверяются только для совпавших.
+    """
+
+    def __init__(self, rules):
+        # rules: [(метка, альтернативы), ...]
+        self._rules = []
+        tokens = []
+        exact = {}
+        for label, alternatives in rules:
+            alts = []
+            for alt in alternatives:
+                if isinstance(alt, Exact):
+                    exact.setdefault(alt.value, []).append(label)
+                else:
+                    alts.append(tuple(alt))
+                    tokens.extend(alt)
+            self._rules.append((label, alts))
+        self._tokens = sorted(set(tokens))
+        self._exact = exact
+
+        gate = [_alternation(tokens)] if tokens else []
+        for value in exact:
+            # "д . р ." и т.п.: символы value с любыми точками/пробелами между ними
+            gate.append("^[ .]*" + "[ .]*".join(re.escape(ch) for ch in value) + "[ .]*$")
+        self._gate = re.compile("|".join(gate)) if gate else None
+
+    def classify(self, text: str) -> list:
+        """Метки всех правил, подходящих для text, в порядке таблицы."""
+        if self._gate is None or not self._gate.search(text):
+            return []
+        present = {t for t in self._tokens if t in text}
+        exact_labels = self._exact.get(text.replace(".", "").replace(" ", ""), ())
+        found = []
+        for label, alts in self._rules:
+            if label in exact_labels or any(all(t in present for t in alt) for alt in alts):
+                found.append(label)
+        return found
+
+
+class HeaderIndex:
+    def __init__(self, rules=HEADER_RULES):
+        self._index = TokenIndex([(rule.key, rule.alternatives) for rule in rules])
+        self._sets_header = {rule.key for rule in rules if rule.sets_header}
+
+    def classify(self, text: str):
+        """[(ключ колонки, задаёт ли строку шапки), ...] для текста ячейки (strip + lower)."""
+        return [(key, key in self._sets_header) for key in self._index.classify(text)]
+
+
+class ParagraphIndex:
+    """
+    Якоря одного режима, собранные в индекс: текст абзаца нормализуется один раз,
+    prefix-якоря проверяются одним regex, tokens-якоря — через TokenIndex.
+    """
+
+    def __init__(self, mode_rules: ModeRules):
+        self.rules = mode_rules
+        self.anchors = mode_rules.anchors
+
+        prefix = [(i, a) for i, a in enumerate(self.anchors) if a.match == "prefix"]
+        self._prefix = None
+        if prefix:
+            # альтернативы проверяются слева направо — побеждает первый якорь в таблице
+            self._prefix = re.compile("|".join(f"(?P<a{i}>{re.escape(a.patterns[0])})" for i, a in prefix))
+
+        self._plain = TokenIndex([(i, a.patterns) for i, a in enumerate(self.anchors) if a.match == "tokens" and not a.squeeze])
+        self._squeezed = TokenIndex([(i, a.patterns) for i, a in enumerate(self.anchors) if a.match == "tokens" and a.squeeze])
+        self._exclude = re.compile(_alternation(mode_rules.exclude)) if mode_rules.exclude else None
+
+    def classify(self, text: str) -> list:
+        """Номера подходящих якорей (по порядку таблицы) для текста абзаца."""
+        text = text or ""
+        found = set()
+        if self._prefix is not None:
+            m = self._prefix.match(text.strip())
+            if m:
+                found.add(int(m.lastgroup[1:]))
+
+        low = text.lower()
+        found.update(self._plain.classify(low))
+        found.update(self._squeezed.classify(low.replace(" ", "")))
+
+        if found and self._exclude is not None and self._exclude.search(low):
+            found = {i for i in found if self.anchors[i].fill != "field"}
+        return sorted(found)
+
+
+HEADER_INDEX = HeaderIndex()
+PARAGRAPH_INDEXES = {mode: ParagraphIndex(rules) for mode, rules in MODE_RULES.items()}
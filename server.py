@@ -0,0 +1,206 @@
+"""
+Режим сервера: одно приложение, несколько пользователей в сети.
+
+    PROFPAK_SERVER=1 streamlit run app.py --server.address 0.0.0.0
+
+Вместо своего пула процессов на каждое задание все задания рендерят в одном
+общем пуле (FairScheduler): процессов не больше PROFPAK_POOL_WORKERS, порции
+строк выдаются пользователям по кругу, поэтому большой Excel одного
+пользователя не задерживает остальных. Настройки — переменные окружения:
+
+    PROFPAK_POOL_WORKERS  процессов рендера (по умолчанию — по числу ядер)
+    PROFPAK_MAX_JOBS      одновременно выполняемых заданий (по умолчанию 4)
+    PROFPAK_MAX_QUEUED    незавершённых заданий на пользователя (по умолчанию 5)
+    PROFPAK_MAX_RUNNING   одновременно выполняемых заданий пользователя (по умолчанию 1;
+                          его задание и так получает весь пул, пока других нет)
+    PROFPAK_MAX_ROWS      сотрудников (строк с ФИО) в одном файле (по умолчанию 50000, 0 — без ограничения)
+    PROFPAK_MAX_UPLOAD_MB размер загруженных файлов задания (по умолчанию 50, 0 — без ограничения)
+"""
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import NamedTuple
+import logging
+import os
+import re
+import threading
+
+from engine import default_workers, make_safe_filename, process_pool_allowed
+
+logger = logging.getLogger(__name__)
+
+
+class ServerConfig(NamedTuple):
+    enabled: bool = False
+    pool_workers: int = 1
+    max_jobs: int = 4
+    max_queued: int = 5
+    max_running: int = 1
+    max_rows: int = 50000
+    max_upload_mb: float = 50
+
+
+def _env_number(name: str, default, cast=int):
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        logger.warning("%s=%r is not a number, using %s", name, value, default)
+        return default
+
+
+def load_config() -> ServerConfig:
+    return ServerConfig(
+        enabled=os.environ.get("PROFPAK_SERVER", "").strip().lower() in ("1", "true", "yes", "on"),
+        pool_workers=max(_env_number("PROFPAK_POOL_WORKERS", default_workers()), 1) if process_pool_allowed() else 1,
+        max_jobs=max(_env_number("PROFPAK_MAX_JOBS", 4), 1),
+        max_queued=max(_env_number("PROFPAK_MAX_QUEUED", 5), 0),
+        max_running=max(_env_number("PROFPAK_MAX_RUNNING", 1), 0),
+        max_rows=max(_env_number("PROFPAK_MAX_ROWS", 50000), 0),
+        max_upload_mb=max(_env_number("PROFPAK_MAX_UPLOAD_MB", 50, float), 0),
+    )
+
+
+def session_namespace(name: str) -> str:
+    """Подпапка пользователя внутри выбранного места сохранения."""
+    return make_safe_filename(name).strip(". ") or "_"
+
+
+def safe_subpath(root: Path, relative: str) -> Path:
+    """
+    root / relative, где relative — введённые пользователем подпапки (через / или \\)
+    или имя файла. Каждая часть очищается как session_namespace, "." и ".." отбрасываются,
+    поэтому путь не выходит за root; ValueError — если всё-таки вышел (например, по ссылке).
+    """
+    parts = [session_namespace(part) for part in re.split(r"[\\/]+", relative) if part.strip(". ")]
+    path = Path(root).joinpath(*parts)
+    if not path.resolve().is_relative_to(Path(root).resolve()):
+        raise ValueError(f"Путь {relative!r} выходит за пределы папки пользователя")
+    return path
+
+
+class SessionPool(NamedTuple):
+    """Доступ одного пользователя к общему пулу: то, что ждёт engine.generate_fanout(pool=...)."""
+
+    scheduler: "FairScheduler"
+    session: str
+
+    @property
+    def window(self) -> int:
+        # сколько порций одно задание держит в очереди: хватает, чтобы пул не простаивал,
+        # но не столько, чтобы одно задание заняло очередь надолго
+        return self.scheduler.workers * 2
+
+    def submit(self, fn, *args) -> Future:
+        return self.scheduler.submit(self.session, fn, *args)
+
+
+class FairScheduler:
+    """
+    Общий ограниченный пул процессов для всех пользователей.
+
+    Порции складываются в очереди по пользователям; диспетчер отдаёт в пул не больше
+    workers порций сразу, беря их из очередей по кругу. Пул создаётся при первой
+    порции и пересоздаётся, если процесс рендера упал.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = max(workers, 1)
+        self._executor = None
+        self._queues = OrderedDict()
+        self._running = Counter()
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def for_session(self, session: str) -> SessionPool:
+        return SessionPool(self, session)
+
+    def submit(self, session: str, fn, *args) -> Future:
+        future = Future()
+        with self._cond:
+            self._queues.setdefault(session, deque()).append((future, fn, args))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._dispatch, name="profpak-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        return future
+
+    def status(self) -> dict:
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "busy": self._in_flight,
+                "queued": {session: len(items) for session, items in self._queues.items()},
+                "running": {session: n for session, n in self._running.items() if n},
+            }
+
+    # ------------------------
+    # Dispatcher
+    # ------------------------
+    def _make_executor(self):
+        if self.workers == 1:
+            # один рендер за раз — без дочерних процессов (в том числе в собранном EXE)
+            return ThreadPoolExecutor(max_workers=1, thread_name_prefix="profpak-render")
+        return ProcessPoolExecutor(max_workers=self.workers)
+
+    def _next(self):
+        # пользователь, чья порция ушла последней, встаёт в конец круга
+        while True:
+            while self._in_flight >= self.workers or not self._queues:
+                self._cond.wait()
+            session, items = next(iter(self._queues.items()))
+            future, fn, args = items.popleft()
+            if items:
+                self._queues.move_to_end(session)
+            else:
+                del self._queues[session]
+            # отменённые (задание остановлено) просто выбрасываем
+            if future.set_running_or_notify_cancel():
+                self._in_flight += 1
+                self._running[session] += 1
+                if self._executor is None:
+                    self._executor = self._make_executor()
+                return session, future, fn, args, self._executor
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                session, future, fn, args, executor = self._next()
+            try:
+                inner = executor.submit(fn, *args)
+            except (BrokenProcessPool, RuntimeError, OSError) as e:
+                self._release(session, executor, broken=True)
+                future.set_exception(e)
+                continue
+            inner.add_done_callback(lambda inner, s=session, f=future, x=executor: self._done(s, f, x, inner))
+
+    def _done(self, session: str, future: Future, executor, inner: Future):
+        # отменённая порция — пул останавливали после сбоя другого процесса
+        error = BrokenProcessPool("render pool was restarted") if inner.cancelled() else inner.exception()
+        self._release(session, executor, broken=isinstance(error, BrokenProcessPool))
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(inner.result())
+
+    def _release(self, session: str, executor, broken: bool = False):
+        restart = False
+        with self._cond:
+            self._in_flight -= 1
+            self._running[session] -= 1
+            if broken and self._executor is executor:
+                logger.warning("Shared render pool is broken, restarting")
+                self._executor = None
+                restart = True
+            self._cond.notify_all()
+        if restart:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+CONFIG = load_config()
+# None — обычный режим: каждое задание запускает свой пул процессов
+scheduler = FairScheduler(CONFIG.pool_workers) if CONFIG.enabled else None
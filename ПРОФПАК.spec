@@ -2,9 +2,9 @@
 from PyInstaller.utils.hooks import collect_all
 from PyInstaller.utils.hooks import copy_metadata
 
-datas = [('C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\app.py', '.')]
+datas = [('C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\app.py', '.'), ('C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\engine.py', '.'), ('C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\output.py', '.'), ('C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\manifest.py', '.'), ('C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\cache.py', '.'), ('C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\rules.py', '.'), ('C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\instrumentation.py', '.'), ('C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\pipeline.py', '.'), ('C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\cli.py', '.'), ('C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\jobs.py', '.'), ('C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\server.py', '.')]
 binaries = []
-hiddenimports = ['ctypes.windll', 'datetime', 'docx', 'docx.Document', 'io.BytesIO', 'logging', 'openpyxl', 'openpyxl.load_workbook', 'openpyxl.utils.datetime.from_excel', 'os', 'pathlib.Path', 're', 'shutil', 'streamlit', 'string', 'tempfile', 'winreg', 'zipfile']
+hiddenimports = ['argparse', 'codecs', 'collections', 'concurrent.futures', 'concurrent.futures.process', 'contextlib', 'copy', 'csv', 'ctypes', 'ctypes.windll', 'ctypes.wintypes', 'datetime', 'docx', 'docx.Document', 'docx.document', 'docx.oxml.ns', 'docx.text.paragraph', 'hashlib', 'heapq', 'io', 'io.BytesIO', 'json', 'logging', 'openpyxl', 'openpyxl.load_workbook', 'openpyxl.utils.datetime.from_excel', 'os', 'pathlib.Path', 'pickle', 'queue', 're', 'shutil', 'streamlit', 'string', 'sys', 'threading', 'time', 'typing', 'uuid', 'winreg', 'zipfile']
 datas += copy_metadata('streamlit')
 tmp_ret = collect_all('streamlit')
 datas += tmp_ret[0]; binaries += tmp_ret[1]; hiddenimports += tmp_ret[2]
@@ -43,10 +43,48 @@ exe = EXE(
     entitlements_file=None,
     icon=['C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\app_icon.ico'],
 )
+# пакетная генерация из командной строки (cli.py): отдельный консольный EXE без streamlit,
+# чтобы запуск по расписанию не ждал загрузки веб-интерфейса
+cli_a = Analysis(
+    ['C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\cli.py'],
+    pathex=['.'],
+    binaries=[],
+    datas=[],
+    hiddenimports=['engine', 'instrumentation', 'output', 'pipeline', 'manifest', 'rules'],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=['streamlit', 'tornado', 'pyarrow', 'pandas', 'altair', 'pydeck', 'watchdog'],
+    noarchive=False,
+    optimize=0,
+)
+cli_pyz = PYZ(cli_a.pure)
+
+cli_exe = EXE(
+    cli_pyz,
+    cli_a.scripts,
+    [],
+    exclude_binaries=True,
+    name='ПРОФПАК-cli',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=True,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+    icon=['C:\\Users\\sched\\VsCodeProjects\\python\\OPDM\\app_icon.ico'],
+)
 coll = COLLECT(
     exe,
     a.binaries,
     a.datas,
+    cli_exe,
+    cli_a.binaries,
+    cli_a.datas,
     strip=False,
     upx=True,
     upx_exclude=[],